@@ -4,9 +4,24 @@ import os
 import yaml
 import textfsm
 import sys
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from scrapli import Scrapli
 
 
+# compiled textfsm templates; key is the filename, value is (mtime, TextFSM)
+_textfsm_cache = {}
+_textfsm_cache_lock = threading.Lock()
+
+# facts configs; files is a dict of filename: (mtime, config), index
+# is a dict of (vendor, platform): (list of filenames, merged list of facts)
+_facts_index = {'files': {}, 'index': {}}
+_facts_index_lock = threading.Lock()
+
+
 def get_loglevel(level):
     if level == 'debug':
         return logging.DEBUG
@@ -22,6 +37,129 @@ def get_loglevel(level):
         return logging.NOTSET
 
 
+def get_textfsm_template(filename):
+    """
+    returns a compiled textfsm template
+
+    The template is compiled once per process and recompiled if the file
+    has changed. Each caller gets its own copy so that parsing does not
+    modify the cached template.
+
+    Args:
+        filename: full path of the template
+
+    Returns: textfsm.TextFSM
+    """
+    mtime = os.path.getmtime(filename)
+    with _textfsm_cache_lock:
+        cached = _textfsm_cache.get(filename)
+        if cached is None or cached[0] != mtime:
+            logging.debug("compiling template %s" % filename)
+            with open(filename) as f:
+                cached = (mtime, textfsm.TextFSM(f))
+            _textfsm_cache[filename] = cached
+    re_table = copy.deepcopy(cached[1])
+    re_table.Reset()
+    return re_table
+
+
+def clear_textfsm_cache():
+    with _textfsm_cache_lock:
+        _textfsm_cache.clear()
+
+
+def parse_textfsm(filename, text):
+    """
+    parses text using a textfsm template
+
+    Args:
+        filename: full path of the template
+        text: output of the device
+
+    Returns: list of dicts
+    """
+    re_table = get_textfsm_template(filename)
+    fsm_results = re_table.ParseText(text)
+    return [dict(zip(re_table.header, pr)) for pr in fsm_results]
+
+
+def _reload_facts_config(directory):
+    """ (re)reads all facts config files that have changed; returns True if something has changed """
+    changed = False
+    files = {}
+    for filename in glob.glob(os.path.join(directory, "*.yaml")):
+        mtime = os.path.getmtime(filename)
+        cached = _facts_index['files'].get(filename)
+        if cached is not None and cached[0] == mtime:
+            files[filename] = cached
+            continue
+        changed = True
+        logging.debug("opening file %s to read facts config" % filename)
+        try:
+            with open(filename) as f:
+                config = yaml.safe_load(f.read())
+            if config is None:
+                logging.error("could not parse file %s" % filename)
+        except Exception as exc:
+            logging.error("could not read file %s; got exception %s" % (filename, exc))
+            config = None
+        files[filename] = (mtime, config)
+
+    if changed or len(files) != len(_facts_index['files']):
+        _facts_index['files'] = files
+        _facts_index['index'] = {}
+        return True
+    return False
+
+
+def get_facts_config(directory, vendor, platform=None):
+    """
+    returns the merged facts of all active config files of a vendor
+
+    The files are parsed once and reloaded if a file has changed. If a
+    platform is given only commands that have a template for this
+    platform are returned.
+
+    Args:
+        directory: directory of the facts config files
+        vendor: vendor (manufacturer) of the device
+        platform: platform of the device
+
+    Returns: (list of filenames, list of facts)
+    """
+    with _facts_index_lock:
+        _reload_facts_config(directory)
+        key = (vendor, platform)
+        if key not in _facts_index['index']:
+            files = []
+            facts = []
+            commands = set()
+            for filename in sorted(_facts_index['files']):
+                config = _facts_index['files'][filename][1]
+                if config is None:
+                    continue
+                name = config.get('name')
+                if not config.get('active'):
+                    logging.debug("config context %s in %s is not active" % (name, filename))
+                    continue
+                file_vendor = config.get("vendor")
+                if file_vendor is None or file_vendor != vendor:
+                    logging.debug("skipping file %s (%s)" % (filename, file_vendor))
+                    continue
+                files.append(os.path.basename(filename))
+                for cmd in config.get('facts', []):
+                    command = cmd["command"]["cmd"]
+                    if platform is not None and platform not in cmd["command"].get("template", {}):
+                        logging.debug("no template for %s on platform %s; skipping command" % (command, platform))
+                        continue
+                    # each command is sent only once even if it is configured in more than one file
+                    if command not in commands:
+                        commands.add(command)
+                        facts.append(cmd)
+            _facts_index['index'][key] = (files, facts)
+        return _facts_index['index'][key]
+
+
 class Devicemanagement:
 
     def __init__(self, **kwargs):
@@ -32,6 +170,17 @@ class Devicemanagement:
         self.__password = None
         self.__port = 22
         self.__connection = None
+        # timeouts in seconds; None means scrapli default
+        self.__timeout_socket = kwargs.get('timeout_socket')
+        self.__timeout_transport = kwargs.get('timeout_transport')
+        self.__timeout_ops = kwargs.get('timeout_ops')
+        # connection pool (see pool.py); None means no pooling
+        self.__pool = kwargs.get('pool')
+        # output of commands sent by this object; command: (time, output)
+        # the cache is bounded and entries expire after command_cache_ttl seconds
+        self.__command_cache = OrderedDict()
+        self.__command_cache_size = kwargs.get('command_cache_size', 32)
+        self.__command_cache_ttl = kwargs.get('command_cache_ttl', 300)
 
         if 'ip' in kwargs:
             self.__ip_address = kwargs['ip']
@@ -80,77 +229,203 @@ class Devicemanagement:
             "port": self.__port,
             "ssh_config_file": "~/.ssh/ssh_config"
         }
+        for key, value in [('timeout_socket', self.__timeout_socket),
+                           ('timeout_transport', self.__timeout_transport),
+                           ('timeout_ops', self.__timeout_ops)]:
+            if value is not None:
+                device[key] = value
+
+        if self.__pool is not None:
+            try:
+                self.__connection = self.__pool.checkout(self._get_pool_key(),
+                                                         lambda: self._open_scrapli(device))
+            except Exception as exc:
+                logging.error(f'could not connect to {self.__ip_address}; got exception {exc}')
+                return False
+            return True
 
-        self.__connection = Scrapli(**device)
         logging.debug("opening connection to device (%s)" % self.__ip_address)
         try:
-            self.__connection.open()
+            self.__connection = self._open_scrapli(device)
         except Exception as exc:
             logging.error(f'could not connect to {self.__ip_address}')
             return False
 
         return True
 
-    def close(self):
+    def _open_scrapli(self, device):
+        connection = Scrapli(**device)
+        connection.open()
+        return connection
+
+    def _get_pool_key(self):
+        return (self.__ip_address, self.__port, self.__username, self.__platform)
+
+    def close(self, discard=False):
+        if self.__pool is not None and self.__connection is not None:
+            logging.debug("returning connection to device (%s) to pool" % self.__ip_address)
+            self.__pool.checkin(self._get_pool_key(), self.__connection, discard=discard)
+            self.__connection = None
+            return
         logging.debug("closing connection to device (%s)" % self.__ip_address)
         try:
             self.__connection.close()
         except:
             logging.error('connection was not open')
 
-    def get_config(self, configtype):
+    def __enter__(self):
+        if not self.__connection:
+            if not self.open():
+                raise ConnectionError("could not connect to %s" % self.__ip_address)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # a session that raised an exception may be broken; do not reuse it
+        self.close(discard=exc_type is not None)
+
+    def _get_cached_output(self, command):
+        entry = self.__command_cache.get(command)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.__command_cache_ttl:
+            del self.__command_cache[command]
+            return None
+        return entry[1]
+
+    def _set_cached_output(self, command, output):
+        self.__command_cache[command] = (time.time(), output)
+        self.__command_cache.move_to_end(command)
+        while len(self.__command_cache) > self.__command_cache_size:
+            self.__command_cache.popitem(last=False)
+
+    def clear_command_cache(self):
+        self.__command_cache.clear()
+
+    def get_config(self, configtype, use_cache=True):
         logging.debug("send show %s to device (%s)" % (configtype, self.__ip_address))
+        response = self.send_commands(["show %s" % configtype], use_cache=use_cache)
+        if response is None:
+            return None
+        return response.get("show %s" % configtype)
+
+    def send_commands(self, commands, batched=True, use_cache=False):
+        """
+        sends a list of commands to the device
+
+        Args:
+            commands: list of commands (str)
+            batched: send all commands using one scrapli send_commands call
+            use_cache: return and keep the output of commands sent by this object
+
+        Returns: dict of command: output or None if the commands could not be sent
+        """
+        outputs = {}
+        missing = []
+        for command in commands:
+            output = self._get_cached_output(command) if use_cache else None
+            if output is None:
+                if command not in missing:
+                    missing.append(command)
+            else:
+                logging.debug("using cached output of %s" % command)
+                outputs[command] = output
+
+        if len(missing) == 0:
+            return outputs
+
         if not self.__connection:
-                if not self.open():
-                    return None
-        response = self.__connection.send_command("show %s" % configtype)
-        return response.result
+            if not self.open():
+                return None
+
+        try:
+            if batched:
+                logging.debug("sending commands %s" % missing)
+                responses = self.__connection.send_commands(missing, stop_on_failed=False)
+            else:
+                responses = []
+                for command in missing:
+                    logging.debug("sending command %s" % command)
+                    responses.append(self.__connection.send_command(command))
+        except Exception as exc:
+            logging.error("could not send commands %s to device; got exception %s" % (missing, exc))
+            return None
 
-    def send_and_parse_command(self, commands):
+        for command, response in zip(missing, responses):
+            outputs[command] = response.result
+            # failed commands are never cached
+            if use_cache and not getattr(response, 'failed', False):
+                self._set_cached_output(command, response.result)
+
+        return outputs
+
+    def send_and_parse_command(self, commands, batched=True, use_cache=False, parse_workers=None):
+        """
+        sends commands to the device and parses the output using textfsm
+
+        Args:
+            commands: list of commands (see conf/facts/facts.yaml)
+            batched: send all commands using one scrapli send_commands call
+            use_cache: use and keep the output of commands sent by this object
+            parse_workers: number of threads used to parse the output (None: no threads)
+
+        Returns: dict of command: parsed output
+        """
         BASEDIR = os.path.abspath(os.path.dirname(__file__))
         directory = os.path.join(BASEDIR, './conf/textfsm')
         result = {}
         mapped = {}
 
+        outputs = self.send_commands([cmd["command"]["cmd"] for cmd in commands],
+                                     batched=batched,
+                                     use_cache=use_cache)
+        if outputs is None:
+            return None
+
+        # get template of each command
+        templates = {}
         for cmd in commands:
             command = cmd["command"]["cmd"]
-            logging.debug("sending command %s" % command)
-            if not self.__connection:
-                if not self.open():
-                    return None
-            try:
-                response = self.__connection.send_command(command)
-            except Exception as exc:
-                logging.error("could not send command %s to device; got exception %s" % (command, exc))
-                return None 
-
             filename = cmd["command"]["template"].get(self.__platform)
             logging.debug("filename is %s" % filename)
             if filename is None:
                 logging.error("no template for platform %s configured" % self.__platform)
                 result[command] = {}
-
-            if not os.path.isfile("%s/%s" % (directory, filename)):
+            elif not os.path.isfile("%s/%s" % (directory, filename)):
                 logging.error("template %s does not exists" % filename)
                 result[command] = {}
+            else:
+                templates[command] = "%s/%s" % (directory, filename)
 
-            try:
-                logging.debug("reading template")
-                template = open("%s/%s" % (directory, filename))
-                re_table = textfsm.TextFSM(template)
-                logging.debug("parsing response")
-                fsm_results = re_table.ParseText(response.result)
-                collection_of_results = [dict(zip(re_table.header, pr)) for pr in fsm_results]
-                result[command] = collection_of_results
-            except Exception as exc:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                logging.error("parser error in line %s; got: %s (%s, %s, %s)" % (exc_tb.tb_lineno,
-                                                                                 exc,
-                                                                                 exc_type,
-                                                                                 exc_obj,
-                                                                                 exc_tb))
-                result[command] = {}
+        # parse output
+        if parse_workers is not None and parse_workers > 1 and len(templates) > 1:
+            # threads share the cache of compiled templates
+            with ThreadPoolExecutor(max_workers=parse_workers) as executor:
+                futures = {command: executor.submit(parse_textfsm, filename, outputs[command])
+                           for command, filename in templates.items()}
+                parsed = {}
+                for command, future in futures.items():
+                    try:
+                        parsed[command] = future.result()
+                    except Exception as exc:
+                        logging.error("parser error (%s); got: %s" % (command, exc))
+                        parsed[command] = {}
+            result.update(parsed)
+        else:
+            for command, filename in templates.items():
+                try:
+                    logging.debug("parsing response")
+                    result[command] = parse_textfsm(filename, outputs[command])
+                except Exception as exc:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    logging.error("parser error in line %s; got: %s (%s, %s, %s)" % (exc_tb.tb_lineno,
+                                                                                     exc,
+                                                                                     exc_type,
+                                                                                     exc_obj,
+                                                                                     exc_tb))
+                    result[command] = {}
 
+        for cmd in commands:
+            command = cmd["command"]["cmd"]
             # check if we have a mapping
             # print(json.dumps(result, indent=4))
             if 'mapping' in cmd["command"]:
@@ -168,46 +443,23 @@ class Devicemanagement:
                         if not is_mapped:
                             m[key] = value
                     mapped[command].append(m)
-                result = mapped
+                result[command] = mapped[command]
 
         return result
 
-    def get_facts(self):
+    def get_facts(self, use_cache=True):
         BASEDIR = os.path.abspath(os.path.dirname(__file__))
         directory = os.path.join(BASEDIR, './conf/facts')
-        files = []
         facts = {}
         values = {}
 
-        # read all facts from config
-        for filename in glob.glob(os.path.join(directory, "*.yaml")):
-            with open(filename) as f:
-                logging.debug("opening file %s to read facts config" % filename)
-                try:
-                    config = yaml.safe_load(f.read())
-                    if config is None:
-                        logging.error("could not parse file %s" % filename)
-                        continue
-                except Exception as exc:
-                    logging.error("could not read file %s; got exception %s" % (filename, exc))
-                    continue
-
-                active = config.get('active')
-                name = config.get('name')
-                if not active:
-                    logging.debug("config context %s in %s is not active" % (name, filename))
-                    continue
-
-                file_vendor = config.get("vendor")
-                if file_vendor is None or file_vendor != self.__manufacturer:
-                    logging.debug("skipping file %s (%s)" % (filename, file_vendor))
-                    continue
-
-                files.append(os.path.basename(filename))
-                values = self.send_and_parse_command(config['facts'])
-                if values is None:
-                    return None
-                # print(json.dumps(values, indent=4))
+        # the facts of all matching config files are sent in one call; the
+        # output is cached so that eg. show version is sent only once
+        files, facts_config = get_facts_config(directory, self.__manufacturer, self.__platform)
+        if len(facts_config) > 0:
+            values = self.send_and_parse_command(facts_config, use_cache=use_cache)
+            if values is None:
+                return None
 
         facts["manufacturer"] = self.__manufacturer
         if "show version" in values:
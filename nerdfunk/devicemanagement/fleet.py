@@ -0,0 +1,132 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import devicemanagement as dm
+
+
+class Fleet:
+    """
+    runs get_facts, get_config or command sets on many devices at once
+
+    Each device is handled by its own Devicemanagement object in a thread
+    pool. The results are yielded as soon as a device has finished.
+
+    usage:
+        fleet = Fleet(sot.get.devices(site='mysite'), username=username, password=password)
+        for host, result in fleet.get_config('running-config'):
+            ...
+    """
+
+    def __init__(self, inventory, **kwargs):
+        self.__username = kwargs.get('username')
+        self.__password = kwargs.get('password')
+        self.__port = kwargs.get('port', 22)
+        self.__manufacturer = kwargs.get('manufacturer', 'cisco')
+        self.__max_workers = kwargs.get('max_workers', 50)
+        # timeout in seconds of the socket, the transport and each operation
+        # of scrapli; it does not limit the total time a device may take
+        self.__scrapli_timeout = kwargs.get('scrapli_timeout', 60)
+        self.__scrapli_loglevel = kwargs.get('scrapli_loglevel')
+        # optional connection pool (see pool.py) to reuse sessions
+        self.__pool = kwargs.get('pool')
+        self.__inventory = self._get_inventory(inventory)
+
+    def _get_inventory(self, inventory):
+        """
+        converts the inventory to a list of dicts with host, ip, platform, credentials
+
+        The inventory is either a list of dicts (ip, platform, username ...)
+        or the result of Getter.devices()
+        """
+        devices = []
+        if isinstance(inventory, dict):
+            # result of sot.get.devices()
+            for hostname, properties in inventory.items():
+                primary_ip = properties.get('primary_ip') or {}
+                platform = properties.get('platform') or {}
+                if not primary_ip.get('address'):
+                    logging.error(f'device {hostname} has no primary IP; skipping device')
+                    continue
+                devices.append({'host': hostname,
+                                'ip': primary_ip['address'].split('/')[0],
+                                'platform': platform.get('slug')})
+        else:
+            for device in inventory:
+                device = dict(device)
+                if 'host' not in device:
+                    device['host'] = device.get('ip')
+                devices.append(device)
+        return devices
+
+    def _run_on_device(self, device, method, args, kwargs):
+        properties = {'ip': device.get('ip'),
+                      'platform': device.get('platform'),
+                      'manufacturer': device.get('manufacturer', self.__manufacturer),
+                      'username': device.get('username', self.__username),
+                      'password': device.get('password', self.__password),
+                      'port': device.get('port', self.__port),
+                      'timeout_socket': self.__scrapli_timeout,
+                      'timeout_transport': self.__scrapli_timeout,
+                      'timeout_ops': self.__scrapli_timeout}
+        if self.__scrapli_loglevel is not None:
+            properties['scrapli_loglevel'] = self.__scrapli_loglevel
+        if self.__pool is not None:
+            properties['pool'] = self.__pool
+        conn = dm.Devicemanagement(**properties)
+        opened = False
+        failed = False
+        try:
+            opened = conn.open()
+            if not opened:
+                return {'success': False, 'error': 'could not connect to device'}
+            result = getattr(conn, method)(*args, **kwargs)
+            if result is None:
+                return {'success': False, 'error': f'{method} failed'}
+            return {'success': True, 'result': result}
+        except Exception as exc:
+            # the session may be broken; do not return it to the pool
+            failed = True
+            logging.error(f'{method} on {device.get("host")} failed; got exception {exc}')
+            return {'success': False, 'error': str(exc)}
+        finally:
+            if opened:
+                conn.close(discard=failed)
+
+    # -----===== user commands =====-----
+
+    def run(self, method, *args, **kwargs):
+        """
+        calls method of Devicemanagement on all devices of the inventory
+
+        Args:
+            method: name of the method (get_facts, get_config, send_and_parse_command ...)
+            *args: args of the method
+            **kwargs: kwargs of the method
+
+        Yields: (host, result) as soon as a device has finished; result is a
+                dict with success and either result or error
+        """
+        logging.debug(f'running {method} on {len(self.__inventory)} device(s) '
+                      f'using {self.__max_workers} worker(s)')
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            futures = {executor.submit(self._run_on_device, device, method, args, kwargs): device
+                       for device in self.__inventory}
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    result = {'success': False, 'error': str(exc)}
+                yield device.get('host'), result
+
+    def get_facts(self):
+        return self.run('get_facts')
+
+    def get_config(self, configtype='running-config'):
+        return self.run('get_config', configtype)
+
+    def send_and_parse_command(self, commands):
+        return self.run('send_and_parse_command', commands)
+
+    def collect(self, method, *args, **kwargs):
+        """ like run but returns a dict of all results """
+        return {host: result for host, result in self.run(method, *args, **kwargs)}
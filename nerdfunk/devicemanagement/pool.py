@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from . import devicemanagement as dm
+
+
+class ConnectionPool:
+    """
+    pool of open scrapli connections
+
+    Connections are keyed by (host, port, username, platform). A connection
+    that is checked in can be reused by the next checkout of the same key
+    as long as it is alive and has not been idle for longer than idle_timeout.
+
+    usage:
+        pool = ConnectionPool(max_sessions=2, idle_timeout=300)
+        with pool.connection(ip=ip, platform='ios', username=username, password=password) as conn:
+            conn.get_config('running-config')
+    """
+
+    def __init__(self, max_sessions=1, idle_timeout=300, checkout_timeout=60):
+        logging.debug(f'Creating CONNECTION POOL; max_sessions={max_sessions} idle_timeout={idle_timeout}')
+        # max. number of sessions per device
+        self.__max_sessions = max_sessions
+        # seconds a session may be idle before it is closed
+        self.__idle_timeout = idle_timeout
+        # seconds to wait for a free session
+        self.__checkout_timeout = checkout_timeout
+        self.__idle = {}
+        self.__in_use = {}
+        self.__condition = threading.Condition()
+
+    def _is_healthy(self, connection, last_used):
+        if self.__idle_timeout is not None and time.time() - last_used > self.__idle_timeout:
+            logging.debug("connection was idle for too long")
+            return False
+        try:
+            return connection.isalive()
+        except Exception:
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _count(self, key):
+        return self.__in_use.get(key, 0) + len(self.__idle.get(key, []))
+
+    # -----===== user commands =====-----
+
+    def checkout(self, key, factory):
+        """
+        returns an open connection
+
+        Args:
+            key: (host, port, username, platform)
+            factory: function that returns a new, open connection
+
+        Returns: scrapli connection
+        """
+        deadline = time.time() + self.__checkout_timeout
+        with self.__condition:
+            while True:
+                # reuse idle connection
+                while len(self.__idle.get(key, [])) > 0:
+                    connection, last_used = self.__idle[key].pop()
+                    if self._is_healthy(connection, last_used):
+                        logging.debug("reusing connection to %s" % key[0])
+                        self.__in_use[key] = self.__in_use.get(key, 0) + 1
+                        return connection
+                    logging.debug("closing stale connection to %s" % key[0])
+                    self._close(connection)
+                if self._count(key) < self.__max_sessions:
+                    # reserve a slot; the connection is opened outside the lock
+                    self.__in_use[key] = self.__in_use.get(key, 0) + 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("no free session to %s" % key[0])
+                self.__condition.wait(remaining)
+
+        try:
+            logging.debug("opening new pooled connection to %s" % key[0])
+            return factory()
+        except Exception:
+            with self.__condition:
+                self.__in_use[key] -= 1
+                self.__condition.notify()
+            raise
+
+    def checkin(self, key, connection, discard=False):
+        """
+        returns a connection to the pool
+
+        Args:
+            key: (host, port, username, platform)
+            connection: scrapli connection
+            discard: close the connection instead of keeping it
+
+        Returns: None
+        """
+        with self.__condition:
+            self.__in_use[key] = max(0, self.__in_use.get(key, 0) - 1)
+            if discard:
+                self._close(connection)
+            else:
+                self.__idle.setdefault(key, []).append((connection, time.time()))
+            self.__condition.notify()
+
+    def cleanup(self):
+        """ closes all idle connections that have timed out or are dead """
+        with self.__condition:
+            for key in list(self.__idle):
+                alive = []
+                for connection, last_used in self.__idle[key]:
+                    if self._is_healthy(connection, last_used):
+                        alive.append((connection, last_used))
+                    else:
+                        self._close(connection)
+                self.__idle[key] = alive
+            self.__condition.notify_all()
+
+    def close_all(self):
+        with self.__condition:
+            for key, connections in self.__idle.items():
+                for connection, last_used in connections:
+                    self._close(connection)
+            self.__idle = {}
+            self.__condition.notify_all()
+
+    @contextmanager
+    def connection(self, **kwargs):
+        """ checks out a Devicemanagement object that uses this pool """
+        conn = dm.Devicemanagement(pool=self, **kwargs)
+        if not conn.open():
+            raise ConnectionError("could not connect to %s" % kwargs.get('ip'))
+        try:
+            yield conn
+        finally:
+            conn.close()
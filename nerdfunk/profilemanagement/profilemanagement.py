@@ -1,7 +1,7 @@
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from nerdfunk.utilities import misc as misc
+from nerdfunk.utilities import kdf as kdf
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.fernet import Fernet
 import getpass
 import os
 import base64
@@ -42,39 +42,58 @@ def get_username_and_password(profile, profile_config, password=None):
     return username, password
 
 
-def decrypt_password(password):
+def _get_key_params(profile=None):
+    """
+
+    returns the encryption key, the salt and the number of iterations used to
+    derive the key; a profile may overwrite the salt and the iterations
+
+    Args:
+        profile: profile of accounts.devices or None
+
+    Returns: (encryption key, salt, iterations)
+
+    """
+    profile = profile or {}
+    salt_ascii = profile.get('salt', os.getenv('SALT'))
+    encryption_key_ascii = os.getenv('ENCRYPTIONKEY')
+    iterations = profile.get('iterations', os.getenv('ITERATIONS'))
+    return str.encode(encryption_key_ascii), str.encode(salt_ascii), int(iterations)
+
+
+def _get_fernet(profile=None):
+    """
+
+    returns the Fernet object of the key configured in our environment
+
+    the derived key is cached; see utilities/kdf.py
+
+    Args:
+        profile: profile that may overwrite salt and iterations
+
+    Returns: Fernet
+
+    """
+    # derive key
+    return kdf.get_fernet(*_get_key_params(profile))
+
+
+def decrypt_password(password, profile=None):
     """
 
     decrypts base64 password that is stored in our yaml config
 
     Args:
         password:
+        profile: profile that may overwrite salt and iterations
 
     Returns: clear password
 
     """
-    # prepare salt
-    salt_ascii = os.getenv('SALT')
-    salt_bytes = str.encode(salt_ascii)
-
-    # prepare encryption key, we need it as bytes
-    encryption_key_ascii = os.getenv('ENCRYPTIONKEY')
-    encryption_key_bytes = str.encode(encryption_key_ascii)
-    iterations = int(os.getenv('ITERATIONS'))
-    # logging.debug(f'salt: {salt_ascii} encryption_key: {encryption_key_ascii} iterations: {iterations}')
     # get password as base64 and convert it to bytes
     password_bytes = base64.b64decode(password)
 
-    # derive key
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt_bytes,
-        iterations=iterations,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(encryption_key_bytes))
-
-    f = Fernet(key)
+    f = _get_fernet(profile)
     # decrypt and return
     try:
         return f.decrypt(password_bytes).decode("utf-8")
@@ -83,6 +102,25 @@ def decrypt_password(password):
         return None
 
 
+def decrypt_many(passwords):
+    """
+
+    decrypts a list of base64 passwords; the key is derived only once
+
+    Args:
+        passwords: list of passwords
+
+    Returns: list of clear passwords (None if a password could not be decrypted)
+
+    """
+    return [decrypt_password(password) for password in passwords]
+
+
+def clear_key_cache():
+    """ removes all derived keys from memory """
+    kdf.clear_key_cache()
+
+
 def get_profile(config, profilename='default'):
     """
         gets profile (username and password) from config
@@ -94,17 +132,109 @@ def get_profile(config, profilename='default'):
 
     """
 
+    if isinstance(config, ProfileVault):
+        return config.get_profile(profilename)
+
     result = {}
     clear_password = None
 
-    username = misc.get_value_from_dict(config, ['accounts', 'devices', profilename, 'username'])
-    password = misc.get_value_from_dict(config, ['accounts', 'devices', profilename, 'password'])
+    profile = misc.get_value_from_dict(config, ['accounts', 'devices', profilename])
+    if profile is None:
+        return {'success': False, 'reason': 'unknown profile'}
+    username = profile.get('username')
+    password = profile.get('password')
 
     if password is not None:
-        clear_password = decrypt_password(password)
+        clear_password = decrypt_password(password, profile)
 
     if clear_password is None:
         return {'success': False, 'reason': 'wrong password'}
     else:
         return {'success': True, 'username': username, 'password': clear_password}
 
+
+class ProfileVault:
+    """
+    decrypts all profiles of accounts.devices once and serves them from memory
+
+    A profile may overwrite the salt and the number of iterations of the
+    environment (like get_profile). Different keys are derived in parallel
+    using a process pool. If the start method is spawn (Windows, macOS) the
+    pool re-imports the main module; scripts must use an
+    if __name__ == '__main__' guard. If the pool cannot be used the keys are
+    derived one after the other. The vault can be used instead of the
+    profile config, e.g. get_username_and_password(profile, vault).
+
+    usage:
+        with ProfileVault(config) as vault:
+            username, password = get_username_and_password('default', vault)
+    """
+
+    def __init__(self, config, zeroize=True, max_workers=None):
+        self.__config = config
+        # overwrite passwords when the vault is closed
+        self.__zeroize = zeroize
+        self.__max_workers = max_workers
+        self.__profiles = None
+
+    def __enter__(self):
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _get_fernets(self, unique_params):
+        """ returns dict of key params: Fernet; different keys are derived in parallel """
+        if len(unique_params) > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=self.__max_workers) as executor:
+                    keys = dict(zip(unique_params,
+                                    executor.map(kdf.derive_key, *zip(*unique_params))))
+                return {p: Fernet(key) for p, key in keys.items()}
+            except Exception as exc:
+                logging.warning(f'could not derive keys in parallel; got exception {exc}')
+        return {p: kdf.get_fernet(*p) for p in unique_params}
+
+    def load(self):
+        logging.debug("loading profile vault")
+        profiles = misc.get_value_from_dict(self.__config, ['accounts', 'devices']) or {}
+        self.__profiles = {}
+
+        # derive each key only once; different keys are derived in parallel
+        params = {name: _get_key_params(profile) for name, profile in profiles.items()
+                  if profile.get('password') is not None}
+        fernets = self._get_fernets(list(set(params.values())))
+
+        for name, profile in profiles.items():
+            clear_password = None
+            if name in params:
+                try:
+                    clear_password = fernets[params[name]].decrypt(base64.b64decode(profile['password']))
+                except Exception:
+                    logging.error(f'could not decrypt password of profile {name}')
+            self.__profiles[name] = {'username': profile.get('username'),
+                                     'password': bytearray(clear_password) if clear_password else None}
+        logging.debug(f'loaded {len(self.__profiles)} profile(s)')
+        return self
+
+    def get_profile(self, profilename='default'):
+        if self.__profiles is None:
+            self.load()
+        profile = self.__profiles.get(profilename)
+        if profile is None:
+            return {'success': False, 'reason': 'unknown profile'}
+        if profile['password'] is None:
+            return {'success': False, 'reason': 'wrong password'}
+        return {'success': True,
+                'username': profile['username'],
+                'password': profile['password'].decode("utf-8")}
+
+    def close(self):
+        if self.__profiles is not None and self.__zeroize:
+            for profile in self.__profiles.values():
+                if profile['password'] is not None:
+                    # passwords already handed out as str cannot be overwritten
+                    for i in range(len(profile['password'])):
+                        profile['password'][i] = 0
+        self.__profiles = None
@@ -0,0 +1,325 @@
+import logging
+import asyncio
+import json
+import ssl
+from . import client
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncClient(object):
+    """
+    asyncio based client to the REST and GraphQL API of nautobot
+
+    The number of concurrent requests is bounded by a semaphore. The
+    timeouts and the retry policy are read from the pool config of nautobot.
+    """
+
+    _retry_status = [429, 500, 502, 503, 504]
+
+    def __init__(self, sot, api_version=None):
+        logging.debug(f'Creating ASYNC CLIENT object')
+        if aiohttp is None:
+            raise ImportError('aiohttp is needed to use the async engine; please install aiohttp')
+        self._sot = sot
+        self._url = sot.get_nautobot_url().rstrip('/')
+        self._token = sot.get_token()
+        self._api_version = api_version
+        self._pool_config = client.get_pool_config((sot.get_config() or {}).get('nautobot'))
+        self._session = None
+        self._semaphore = None
+
+    def _get_ssl(self):
+        """ verify is a bool or the path of a CA bundle (like requests) """
+        verify = self._pool_config.get('verify', True)
+        if isinstance(verify, str):
+            return ssl.create_default_context(cafile=verify)
+        return bool(verify)
+
+    async def open(self):
+        if self._session is None:
+            headers = {'Authorization': f'Token {self._token}',
+                       'Accept': 'application/json',
+                       'Content-Type': 'application/json'}
+            if self._api_version is not None:
+                headers['Accept'] = f'application/json; version={self._api_version}'
+            concurrency = self._pool_config.get('async_concurrency', self._pool_config.get('pool_maxsize'))
+            connector = aiohttp.TCPConnector(limit=concurrency, ssl=self._get_ssl())
+            timeout = aiohttp.ClientTimeout(total=self._pool_config.get('timeout'))
+            self._session = aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout)
+            self._semaphore = asyncio.Semaphore(concurrency)
+        return self
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_url(self, endpoint):
+        """
+        returns the url of an endpoint
+
+        endpoint is either a pynautobot endpoint (eg. nautobot.dcim.devices)
+        or a string like 'dcim.devices' or 'dcim/devices'
+        """
+        if hasattr(endpoint, 'url'):
+            return endpoint.url.rstrip('/')
+        return "%s/api/%s" % (self._url, endpoint.replace('.', '/').strip('/'))
+
+    async def request(self, method, url, **kwargs):
+        await self.open()
+        retries = self._pool_config.get('retries', 0)
+        backoff_factor = self._pool_config.get('backoff_factor', 0)
+        for attempt in range(retries + 1):
+            try:
+                async with self._semaphore:
+                    async with self._session.request(method, url, **kwargs) as resp:
+                        if resp.status in self._retry_status and attempt < retries:
+                            logging.debug(f'got status {resp.status} from {url}; retrying')
+                        else:
+                            if resp.status >= 400:
+                                text = await resp.text()
+                                raise Exception(f'{method} {url} returned {resp.status}; {text}')
+                            if resp.status == 204:
+                                return True
+                            return await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if attempt >= retries:
+                    raise
+                logging.debug(f'got exception {exc} from {url}; retrying')
+            await asyncio.sleep(backoff_factor * (2 ** attempt))
+
+    async def get_list(self, endpoint, page_size=None, **filter):
+        """ returns all records of an endpoint; the pages are fetched concurrently """
+        url = "%s/" % self.get_url(endpoint)
+        limit = page_size or self._pool_config.get('page_size', 1000)
+        params = self._get_params(filter)
+        first = await self.request('GET', url, params=params + [('limit', limit), ('offset', 0)])
+        results = list(first.get('results', []))
+        count = first.get('count', len(results))
+        if count > len(results):
+            pages = await asyncio.gather(*[
+                self.request('GET', url, params=params + [('limit', limit), ('offset', offset)])
+                for offset in range(limit, count, limit)])
+            for page in pages:
+                results.extend(page.get('results', []))
+        return results
+
+    async def graphql(self, query, variables=None):
+        return await self.request('POST', "%s/api/graphql/" % self._url,
+                                  data=json.dumps({'query': query, 'variables': variables or {}}))
+
+    def _get_params(self, filter):
+        # aiohttp needs a list of tuples to send one parameter more than once
+        params = []
+        for key, value in filter.items():
+            if isinstance(value, (list, tuple, set)):
+                params.extend([(key, str(v)) for v in value])
+            elif isinstance(value, bool):
+                params.append((key, str(value).lower()))
+            elif value is not None:
+                params.append((key, str(value)))
+        return params
+
+
+class AsyncCentral(object):
+    """ async variant of Central; records are returned as dict """
+
+    def __init__(self, sot, aio_client):
+        logging.debug(f'initializing async central')
+        self._sot = sot
+        self._client = aio_client
+
+    async def get_entity(self, func, title, getter):
+        logging.debug("-- entering sot/aio.py/get_entity")
+        try:
+            entities = await self._client.get_list(func, **getter)
+        except Exception as exc:
+            logging.error(f'could not get entity; got exception {exc}')
+            return None
+        if len(entities) == 0:
+            logging.debug(f'entity not found in sot')
+            return None
+        if len(entities) > 1:
+            logging.error(f'got more than one {title}; please use a unique getter')
+            return None
+        return entities[0]
+
+    async def add_entity(self, func, properties, convert_id=False):
+        logging.debug(f'-- entering sot/aio.py/add_entity')
+        if convert_id:
+            success, response = await self.get_ids(properties)
+            if not success:
+                logging.error(f'could not convert items to IDs; response: {response}')
+                return None
+        try:
+            item = await self._client.request('POST', "%s/" % self._client.get_url(func),
+                                              data=json.dumps(properties))
+            logging.debug("entity added to sot")
+            return item
+        except Exception as exc:
+            logging.error("entity not added to sot; got exception %s" % exc)
+            logging.error(f'properties: {properties}')
+            return None
+
+    async def update_entity(self, func, properties, getter, convert_id=True):
+        logging.debug("-- entering sot/aio.py/update_entity")
+        entity = await self.get_entity(func, "entity", getter)
+        if entity is None:
+            return None
+        if convert_id:
+            success, response = await self.get_ids(properties)
+            if not success:
+                logging.error("could not convert items to IDs")
+                return None
+        try:
+            item = await self._client.request('PATCH', "%s/%s/" % (self._client.get_url(func), entity['id']),
+                                              data=json.dumps(properties))
+            logging.debug("entity updated in sot")
+            return item
+        except Exception as exc:
+            logging.error("entity not updated in sot; got exception %s" % exc)
+            return None
+
+    async def delete_entity(self, func, title, message, getter):
+        logging.debug("-- entering sot/aio.py/delete_entity")
+        entity = await self.get_entity(func, title, getter)
+        if entity is None:
+            logging.debug(f'{title} not found in sot')
+            return None
+        try:
+            await self._client.request('DELETE', "%s/%s/" % (self._client.get_url(func), entity['id']))
+            logging.debug("%s deleted from sot" % title)
+            return entity
+        except Exception as exc:
+            logging.error("%s not deleted from sot; got exception %s" % (title, exc))
+            return None
+
+    async def _resolve(self, kind, endpoint, attribute, value):
+        cache = self._sot.get_id_cache()
+        id = cache.get(kind, value)
+        if id is None:
+            entity = await self.get_entity(endpoint, kind, {attribute: value})
+            if entity is None:
+                return None
+            id = entity['id']
+            cache.set(kind, value, id)
+        return id
+
+    async def get_ids(self, newconfig):
+        logging.debug("-- entering sot/aio.py/get_ids")
+        success = True
+        error = ""
+
+        if 'primary_ip4' in newconfig:
+            id = await self._resolve('ip_address', 'ipam.ip_addresses', 'address', newconfig['primary_ip4'])
+            if id is None:
+                success = False
+                error = 'unknown IP address "%s"' % newconfig['primary_ip4']
+            else:
+                newconfig['primary_ip4'] = id
+
+        if 'location' in newconfig:
+            id = await self._resolve('location', 'dcim.locations', 'slug', newconfig['location'])
+            if id is None:
+                success = False
+                error = 'unknown location "%s"' % newconfig['location']
+            else:
+                newconfig['location'] = id
+
+        if 'serial_number' in newconfig:
+            newconfig['serial_number'] = newconfig['serial_number'] \
+                .replace("'", "") \
+                .replace("\"", "") \
+                .replace("{", "") \
+                .replace("}", "")
+
+        return success, error
+
+
+class AsyncGetter(object):
+    """ async variant of Getter; returns the same shapes as Getter using as_dict """
+
+    def __init__(self, sot, aio_client):
+        logging.debug(f'initializing async getter')
+        self._sot = sot
+        self._client = aio_client
+        self._central = AsyncCentral(sot, aio_client)
+
+    async def query(self, name=None, query=None, query_params=None):
+        logging.debug("-- entering sot/aio.py/query")
+        if name is not None:
+            query = self._sot.get_config()['nautobot'].get(name)
+            if query is None:
+                logging.error("unkown query %s" % name)
+                return None
+        return await self._client.graphql(query, query_params)
+
+    async def device(self, device=None, ip=None):
+        logging.debug("-- entering sot/aio.py/device")
+        if device is not None:
+            getter = {'name__ie': device}
+        elif ip is not None:
+            response = await self.query(name='device_properties_by_cidr', query_params={'cidr': ip})
+            addresses = response['data']['ip_addresses']
+            if len(addresses) == 0 or addresses[0]['primary_ip4_for'] is None:
+                logging.debug("device %s not found in sot" % ip)
+                return {}
+            getter = {'name': addresses[0]['primary_ip4_for']['hostname']}
+        else:
+            return {}
+        entity = await self._central.get_entity('dcim.devices', "Device", getter)
+        return entity if entity else {}
+
+    async def devices(self, **properties):
+        logging.debug("-- entering sot/aio.py/devices")
+        devices = {}
+        if 'cidr' in properties:
+            raw = await self.query(name='device_properties_by_cidr', query_params=properties)
+            data = [d.get('primary_ip4_for') for d in raw['data']['ip_addresses']]
+        else:
+            raw = await self.query(name='device_properties', query_params=properties)
+            data = raw['data']['devices']
+
+        for device in data:
+            if device:
+                devices[device.get('hostname')] = {'primary_ip': device.get('primary_ip4'),
+                                                   'device_type': device.get('device_type'),
+                                                   'device_role': device.get('device_role'),
+                                                   'platform': device.get('platform')}
+        return devices
+
+    async def filter(self, **filter):
+        logging.debug(f'getting filtered list of devices from sot using {filter}')
+        devices = await self._client.get_list('dcim.devices', **filter)
+        return {device.get('name') or device.get('display'): device for device in devices}
+
+
+class Aio(object):
+    """
+    container of the async getter and central
+
+    usage:
+        async with sot.aio as aio:
+            devices = await asyncio.gather(*[aio.get.device(device=n) for n in names])
+    """
+
+    def __init__(self, sot):
+        logging.debug(f'Creating AIO object')
+        self._sot = sot
+        self._client = AsyncClient(sot)
+        self.get = AsyncGetter(sot, self._client)
+        self.central = AsyncCentral(sot, self._client)
+
+    async def __aenter__(self):
+        await self._client.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        await self._client.close()
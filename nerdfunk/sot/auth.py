@@ -1,9 +1,7 @@
 import logging
 import base64
 import os
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from ..utilities import kdf
 
 class Auth(object):
 
@@ -31,35 +29,30 @@ class Auth(object):
     def set_iterations(self, iterations):
         self._iterations = iterations
 
+    def _get_fernet(self):
+        # the derived key is cached; see utilities/kdf.py
+        return kdf.get_fernet(str.encode(self._encryption_key_ascii),
+                              self._salt_bytes,
+                              int(self._iterations))
+
     def encrypt(self, password):
         password_bytes = str.encode(password)
-        encrypt_pwd_bytes = str.encode(self._encryption_key_ascii)
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self._salt_bytes,
-            iterations=self._iterations,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(encrypt_pwd_bytes))
-        f = Fernet(key)
+        f = self._get_fernet()
         token = f.encrypt(password_bytes)
         return base64.b64encode(token)
 
     def decrypt(self, token_ascii):
         token_bytes = base64.b64decode(token_ascii)
-        encryption_key_bytes = str.encode(self._encryption_key_ascii)
-
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self._salt_bytes,
-            iterations=self._iterations,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(encryption_key_bytes))
-
-        f = Fernet(key)
+        f = self._get_fernet()
         try:
             return f.decrypt(token_bytes).decode("utf-8")
         except Exception as e:
             logging.error("Wrong encryption key or salt %s" % e)
             return None
+
+    def decrypt_many(self, tokens):
+        """ decrypts a list of tokens; the key is derived only once """
+        return [self.decrypt(token) for token in tokens]
+
+    def clear_key_cache(self):
+        kdf.clear_key_cache()
@@ -0,0 +1,176 @@
+import logging
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdCache(object):
+    """
+    cache to resolve names or slugs (site, location, vlan, tag ...) to IDs
+
+    Each kind of object has its own LRU with its own TTL. If a filename
+    is configured the cache is stored in a sqlite database and reloaded
+    the next time the cache is opened.
+    """
+
+    # default TTL in seconds
+    _default_ttl = 3600
+
+    def __init__(self, ttl=None, maxsize=10000, filename=None):
+        logging.debug(f'Creating ID CACHE object; maxsize={maxsize} filename={filename}')
+        self._lock = threading.RLock()
+        self._ttl = {}
+        self._maxsize = maxsize
+        self._filename = None
+        self._db = None
+        self._cache = {}
+        self._hits = {}
+        self._misses = {}
+
+        if isinstance(ttl, dict):
+            self._ttl = dict(ttl)
+        elif ttl is not None:
+            self._default_ttl = ttl
+
+        if filename:
+            self._filename = os.path.expanduser(filename)
+            self._open_db()
+
+    # -----===== internals =====-----
+
+    def _open_db(self):
+        directory = os.path.dirname(self._filename)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(self._filename, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS id_cache ('
+                             'kind TEXT, key TEXT, value TEXT, expires REAL, '
+                             'PRIMARY KEY (kind, key))')
+            self._db.commit()
+        except Exception as exc:
+            logging.error(f'could not open id cache {self._filename}; got exception {exc}')
+            self._db = None
+            return
+
+        now = time.time()
+        self._db.execute('DELETE FROM id_cache WHERE expires < ?', (now,))
+        rows = self._db.execute('SELECT kind, key, value, expires FROM id_cache ORDER BY expires').fetchall()
+        for kind, key, value, expires in rows:
+            self._get_lru(kind)[self._load_key(key)] = (json.loads(value), expires)
+        self._db.commit()
+        logging.debug(f'loaded {len(rows)} entries from id cache {self._filename}')
+
+    def _dump_key(self, key):
+        return json.dumps(key)
+
+    def _load_key(self, key):
+        key = json.loads(key)
+        # json has no tuples
+        if isinstance(key, list):
+            return tuple(key)
+        return key
+
+    def _get_lru(self, kind):
+        if kind not in self._cache:
+            self._cache[kind] = OrderedDict()
+        return self._cache[kind]
+
+    def _set(self, kind, key, value):
+        lru = self._get_lru(kind)
+        expires = time.time() + self.get_ttl(kind)
+        lru[key] = (value, expires)
+        lru.move_to_end(key)
+        evicted = []
+        while len(lru) > self._maxsize:
+            evicted.append(lru.popitem(last=False)[0])
+        if self._db is not None:
+            self._db.execute('INSERT OR REPLACE INTO id_cache VALUES (?, ?, ?, ?)',
+                             (kind, self._dump_key(key), json.dumps(value), expires))
+            if len(evicted) > 0:
+                self._db.executemany('DELETE FROM id_cache WHERE kind = ? AND key = ?',
+                                     [(kind, self._dump_key(k)) for k in evicted])
+
+    def _commit(self):
+        if self._db is not None:
+            try:
+                self._db.commit()
+            except Exception as exc:
+                logging.error(f'could not write id cache; got exception {exc}')
+
+    # -----===== user commands =====-----
+
+    def get_ttl(self, kind):
+        return self._ttl.get(kind, self._default_ttl)
+
+    def set_ttl(self, kind, ttl):
+        self._ttl[kind] = ttl
+
+    def get(self, kind, key):
+        with self._lock:
+            entry = self._get_lru(kind).get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires >= time.time():
+                    self._cache[kind].move_to_end(key)
+                    self._hits[kind] = self._hits.get(kind, 0) + 1
+                    return value
+                del self._cache[kind][key]
+            self._misses[kind] = self._misses.get(kind, 0) + 1
+            return None
+
+    def set(self, kind, key, value):
+        with self._lock:
+            self._set(kind, key, value)
+            self._commit()
+
+    def set_many(self, kind, items):
+        """ set all items (a dict or a list of key/value pairs) of one kind """
+        if isinstance(items, dict):
+            items = items.items()
+        with self._lock:
+            for key, value in items:
+                self._set(kind, key, value)
+            self._commit()
+
+    def delete(self, kind, key):
+        with self._lock:
+            self._get_lru(kind).pop(key, None)
+            if self._db is not None:
+                self._db.execute('DELETE FROM id_cache WHERE kind = ? AND key = ?',
+                                 (kind, self._dump_key(key)))
+                self._commit()
+
+    def clear(self, kind=None):
+        with self._lock:
+            if kind is None:
+                self._cache = {}
+                if self._db is not None:
+                    self._db.execute('DELETE FROM id_cache')
+            else:
+                self._cache.pop(kind, None)
+                if self._db is not None:
+                    self._db.execute('DELETE FROM id_cache WHERE kind = ?', (kind,))
+            self._commit()
+
+    def items(self, kind):
+        """ returns all (not expired) items of one kind as dict """
+        now = time.time()
+        with self._lock:
+            return {key: value for key, (value, expires) in self._get_lru(kind).items() if expires >= now}
+
+    def stats(self):
+        with self._lock:
+            return {'hits': dict(self._hits),
+                    'misses': dict(self._misses),
+                    'size': {kind: len(lru) for kind, lru in self._cache.items()}}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._commit()
+                self._db.close()
+                self._db = None
@@ -1,5 +1,4 @@
 import logging
-from pynautobot import api
 from pynautobot.models.dcim import Interfaces
 from pynautobot.models.dcim import Devices
 from pynautobot.models.ipam import IpAddresses
@@ -9,14 +8,22 @@ from pynautobot.core.response import Record
 
 class Central(object):
 
+    # attributes used to compare a name, slug or address with a related object
+    _natural_keys = ['id', 'name', 'slug', 'address', 'prefix', 'model']
+    # defaults of the bulk config (nautobot.bulk) used by all bulk operations
+    _bulk_defaults = {'chunk_size': 250, 'max_workers': 4}
+
     def __init__(self, sot):
         logging.debug(f'initializing central')
         self._nautobot = None
         self._sot = sot
+        # number of updates that were sent or skipped because nothing has changed
+        self._written = 0
+        self._skipped = 0
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot()
 
     def get_entity(self, func, title, getter):
         logging.debug("-- entering sot/central.py/get_entity")
@@ -32,24 +39,114 @@ class Central(object):
 
         return entity
 
-    def update_entity(self, func, properties, getter, convert_id=True):
-        logging.debug("-- entering sot/central.py/update_entity")
+    def get_bulk_config(self):
+        """ returns the bulk config (nautobot.bulk) including the defaults """
+        config = dict(self._bulk_defaults)
+        config.update(((self._sot.get_config() or {}).get('nautobot') or {}).get('bulk') or {})
+        return config
+
+    def _get_value(self, current, key):
         """
-        func: used to get the updates entity
-        properties: the new properties of the entity
+        returns an attribute of a record or a dict
+
+        getattr would make pynautobot get the full details of a (nested)
+        record if the attribute is missing; only the known attributes are used.
         """
+        if isinstance(current, Record):
+            return vars(current).get(key)
+        return current.get(key)
 
-        # check if entity is part of sot
+    def _matches(self, current, value):
+        """ returns True if the current value of an entity equals the desired value """
+        if isinstance(current, (Record, dict)):
+            if isinstance(value, dict):
+                return all(self._matches(self._get_value(current, k), v) for k, v in value.items())
+            if self._get_value(current, 'value') is not None and self._get_value(current, 'id') is None:
+                # choice like status or mode
+                return self._matches(self._get_value(current, 'value'), value)
+            return any(str(self._get_value(current, key)) == str(value)
+                       for key in self._natural_keys if self._get_value(current, key) is not None)
+        if isinstance(value, (list, tuple, set)):
+            current = list(current or [])
+            value = list(value)
+            if len(current) != len(value):
+                return False
+            # sets like tags; the order does not matter
+            return all(any(self._matches(c, v) for c in current) for v in value)
+        if current is None or value is None:
+            return current == value
+        return current == value or str(current) == str(value)
+
+    def _get_changes(self, entity, properties):
+        """ returns the properties that differ from the entity """
+        changes = {}
+        for key, value in properties.items():
+            if not self._matches(self._get_value(entity, key), value):
+                changes[key] = value
+        return changes
+
+    def stats(self):
+        return {'written': self._written, 'skipped': self._skipped}
+
+    def reset_stats(self):
+        self._written = 0
+        self._skipped = 0
+
+    def _get_entity(self, func, getter):
+        """ returns the entity; a record is used as it is without sending a request """
+        if isinstance(getter, Record):
+            return getter
         try:
             # logging.debug(f'getter: {getter}')
             entity = func.get(**getter)
             if entity is None:
                 logging.debug(f'entity not found in sot')
-                return None
+            return entity
         except Exception as exc:
             logging.error(f'could not get entity; got exception {exc}')
             return None
 
+    def _update_by_id(self, func, properties, id, convert_id):
+        if convert_id:
+            success, response = self.get_ids(properties)
+            if not success:
+                logging.error("could not convert items to IDs")
+                return None
+        try:
+            entities = func.update([dict(properties, id=id)])
+            self._written += 1
+            logging.debug("entity updated in sot")
+            return entities[0] if entities else None
+        except Exception as exc:
+            logging.error("entity not updated in sot; got exception %s" % exc)
+            return None
+
+    def update_entity(self, func, properties, getter, convert_id=True):
+        logging.debug("-- entering sot/central.py/update_entity")
+        """
+        func: used to get the updates entity
+        properties: the new properties of the entity
+        getter: dict to get the entity, the entity (record) itself or its ID
+
+        only the properties that differ from the entity are sent; if
+        nothing has changed no request is sent at all
+        """
+
+        if not isinstance(getter, (dict, Record)):
+            # the ID is known; there is no record to compare with
+            return self._update_by_id(func, properties, getter, convert_id)
+
+        # check if entity is part of sot
+        entity = self._get_entity(func, getter)
+        if entity is None:
+            return None
+
+        properties = self._get_changes(entity, properties)
+        if len(properties) == 0:
+            logging.debug("entity unchanged; skipping update")
+            self._skipped += 1
+            return entity
+
         if convert_id:
             success, response = self.get_ids(properties)
             if not success:
@@ -58,15 +155,88 @@ class Central(object):
         try:
             success = entity.update(properties)
             if success:
+                self._written += 1
                 logging.debug("entity updated in sot")
             else:
+                self._skipped += 1
                 logging.debug("entity not updated in sot")
             return entity
         except Exception as exc:
             logging.error("entity not updated in sot; got exception %s" % exc)
             return None
 
-        return entity
+    def update_entities(self, func, updates, convert_id=True, chunk_size=None):
+        """
+        updates many entities of one endpoint using bulk PATCH requests
+
+        Entities given by ID are read using one request. Entities that have
+        not changed are skipped and only changed properties are sent.
+
+        Args:
+            func: endpoint (eg. nautobot.dcim.devices)
+            updates: list of (record or id, properties)
+            convert_id: convert names and addresses to IDs (see get_ids)
+            chunk_size: max. number of entities per request (default: chunk_size of the bulk config)
+
+        Returns: dict with the number of written, skipped and failed entities
+        """
+        logging.debug("-- entering sot/central.py/update_entities")
+        response = {'written': 0, 'skipped': 0, 'failed': 0}
+        if chunk_size is None:
+            chunk_size = self.get_bulk_config().get('chunk_size')
+
+        ids = [str(entity) for entity, properties in updates if not isinstance(entity, Record)]
+        entities = {}
+        if len(ids) > 0:
+            try:
+                for i in range(0, len(ids), chunk_size):
+                    entities.update({str(e.id): e for e in func.filter(id=ids[i:i + chunk_size])})
+            except Exception as exc:
+                logging.error(f'could not get entities; got exception {exc}')
+                response['failed'] = len(updates)
+                return response
+
+        changed = []
+        for entity, properties in updates:
+            if not isinstance(entity, Record):
+                if str(entity) not in entities:
+                    logging.error(f'entity {entity} not found in sot')
+                    response['failed'] += 1
+                    continue
+                entity = entities[str(entity)]
+            changes = self._get_changes(entity, properties)
+            if len(changes) == 0:
+                response['skipped'] += 1
+            else:
+                changed.append((entity, changes))
+
+        patches = []
+        if convert_id and len(changed) > 0:
+            # resolve the IDs of all properties using one request per kind
+            self.prepare_ids([changes for entity, changes in changed])
+        for entity, changes in changed:
+            if convert_id:
+                success, error = self.get_ids(changes)
+                if not success:
+                    logging.error(f'could not convert items to IDs; {error}')
+                    response['failed'] += 1
+                    continue
+            changes['id'] = entity.id
+            patches.append(changes)
+
+        for i in range(0, len(patches), chunk_size):
+            chunk = patches[i:i + chunk_size]
+            try:
+                func.update(chunk)
+                response['written'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not update {len(chunk)} entities; got exception {exc}')
+                response['failed'] += len(chunk)
+
+        self._written += response['written']
+        self._skipped += response['skipped']
+        logging.debug(f'updated entities; {response}')
+        return response
 
     def add_entity(self, func, properties, convert_id=False):
         logging.debug(f'-- entering central.py/add_entity')
@@ -90,6 +260,28 @@ class Central(object):
             logging.debug(f'-- leaving central.py/add_entity')
             return None
 
+    def add_chunk(self, func, chunk):
+        """
+        adds a chunk of entities using one request
+
+        nautobot creates all items of a request or none. If the request
+        fails each item is added on its own to find the failed items.
+
+        Returns: list of (success, record or error) per item
+        """
+        try:
+            return [(True, item) for item in func.create(chunk)]
+        except Exception as exc:
+            logging.debug(f'could not add chunk of {len(chunk)} item(s); got exception {exc}; adding items one by one')
+        results = []
+        for properties in chunk:
+            try:
+                results.append((True, func.create(properties)))
+            except Exception as exc:
+                logging.error(f'could not add {properties}; got exception {exc}')
+                results.append((False, str(exc)))
+        return results
+
     def delete_entity(self, func, title, message, getter):
         logging.debug("-- entering sot/central.py/delete_entity")
         message = dict(message)
@@ -116,14 +308,20 @@ class Central(object):
                                     'log': 'error: got exception'
                             })
 
-        # look if entity is in sot
-        try:
-            entity = func.get(**getter)
-            if entity is None:
-                logging.debug(f'{title} not found in sot')
+        if not isinstance(getter, (dict, Record)):
+            # the ID is known; delete the entity without getting it first
+            try:
+                success = func.delete([getter])
+                logging.debug("%s deleted from sot" % title)
+                return success
+            except Exception as exc:
+                logging.error("%s not deleted from sot; got exception %s" % (title, exc))
                 return None
-        except Exception as exc:
-            logging.error(f'could not get entity; got exception {exc}')
+
+        # look if entity is in sot
+        entity = self._get_entity(func, getter)
+        if entity is None:
+            logging.debug(f'{title} not found in sot')
             return None
 
         # delete it
@@ -140,6 +338,33 @@ class Central(object):
             got_exception.update({'exception': exc})
             return None
 
+    def delete_entities(self, func, entities, chunk_size=None):
+        """
+        deletes many entities of one endpoint using bulk DELETE requests
+
+        Args:
+            func: endpoint (eg. nautobot.dcim.interfaces)
+            entities: list of records or IDs
+            chunk_size: max. number of entities per request (default: chunk_size of the bulk config)
+
+        Returns: dict with the number of deleted and failed entities
+        """
+        logging.debug("-- entering sot/central.py/delete_entities")
+        response = {'deleted': 0, 'failed': 0}
+        if chunk_size is None:
+            chunk_size = self.get_bulk_config().get('chunk_size')
+        ids = [entity.id if isinstance(entity, Record) else entity for entity in entities]
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            try:
+                func.delete(chunk)
+                response['deleted'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not delete {len(chunk)} entities; got exception {exc}')
+                response['failed'] += len(chunk)
+        logging.debug(f'deleted entities; {response}')
+        return response
+
         # -----===== general methods =====-----
 
     def _get_vlan(self, vid, site):
@@ -147,18 +372,16 @@ class Central(object):
         logging.debug(f'getting vlan: {vid} / {site}')
         self.open_nautobot()
 
-        vlans = self._nautobot.ipam.vlans.filter(vid=vid)
-        for vlan in vlans:
-            try:
-                site_name = vlan.site.name
-            except Exception:
-                site_name = None
-
-            if site_name == site:
-                return vlan
+        vlan = self._sot.get_vlan_index().get(vid, site)
+        if vlan is None:
+            logging.debug("no VLAN found")
+        return vlan
 
-        logging.debug("no VLAN found")
-        return None
+    def prepare_ids(self, list_of_properties):
+        logging.debug("-- entering sot/central.py/prepare_ids")
+        # resolve the IDs of all properties of a batch of updates using one request per kind
+        self._sot.resolver.prepare(list_of_properties)
+        return self._sot.resolver.stats()
 
     def get_ids(self, newconfig, convert_device_to_uuid=True, convert_interface_to_uuid=False):
         logging.debug("-- entering sot/central.py/get_ids")
@@ -166,21 +389,23 @@ class Central(object):
         success = True
         error = ""
 
+        # IDs are resolved using the shared resolver; use prepare_ids to
+        # resolve the IDs of a batch of updates at once
         if 'primary_ip4' in newconfig:
-            nb_addr = self._nautobot.ipam.ip_addresses.get(address=newconfig['primary_ip4'])
-            if nb_addr is None:
+            nb_addr_id = self._sot.resolver.resolve('ip_address', newconfig['primary_ip4'])
+            if nb_addr_id is None:
                 success = False
                 error = 'unknown IP address "%s"' % newconfig['primary_ip4']
             else:
-                newconfig['primary_ip4'] = nb_addr.id
+                newconfig['primary_ip4'] = nb_addr_id
 
         if 'location' in newconfig:
-            nb_location = self._nautobot.dcim.locations.get(slug=newconfig['location'])
-            if nb_location is None:
+            nb_location_id = self._sot.resolver.resolve('location', newconfig['location'])
+            if nb_location_id is None:
                 success = False
                 error = 'unknown location "%s"' % newconfig['location']
             else:
-                newconfig['location'] = nb_location.id
+                newconfig['location'] = nb_location_id
 
         if 'serial_number' in newconfig:
             # some devices have more than one serial number
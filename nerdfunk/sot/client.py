@@ -0,0 +1,94 @@
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pynautobot import api
+
+
+# default values of the connection pool; can be overwritten by
+# the pool section of the nautobot config
+_pool_defaults = {'pool_connections': 10,
+                  'pool_maxsize': 50,
+                  'retries': 3,
+                  'backoff_factor': 0.5,
+                  'status_forcelist': [429, 500, 502, 503, 504],
+                  'timeout': 30,
+                  'verify': True,
+                  # page size used to get lists
+                  'page_size': 1000}
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter that uses a default timeout if the caller has not set one """
+
+    def __init__(self, *args, **kwargs):
+        self._timeout = kwargs.pop('timeout', None)
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self._timeout
+        return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+
+def get_pool_config(config):
+    """
+    merges the pool section of the nautobot config with our defaults
+
+    Args:
+        config: nautobot config (dict)
+
+    Returns: pool config as dict
+    """
+    pool_config = dict(_pool_defaults)
+    if config is not None:
+        pool_config.update(config.get('pool') or {})
+    return pool_config
+
+
+def get_session(pool_config):
+    """
+    returns a requests session with a keep-alive pool and a retry policy
+
+    Args:
+        pool_config: pool config (see get_pool_config)
+
+    Returns: requests.Session
+    """
+    retry = Retry(total=pool_config.get('retries'),
+                  connect=pool_config.get('retries'),
+                  read=pool_config.get('retries'),
+                  backoff_factor=pool_config.get('backoff_factor'),
+                  status_forcelist=pool_config.get('status_forcelist'))
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_config.get('pool_connections'),
+                                 pool_maxsize=pool_config.get('pool_maxsize'),
+                                 max_retries=retry,
+                                 timeout=pool_config.get('timeout'))
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.verify = pool_config.get('verify', True)
+    return session
+
+
+def open_nautobot(url, token, config=None, api_version=None):
+    """
+    opens a pynautobot api that uses our pooled session
+
+    Args:
+        url: url of nautobot
+        token: api token
+        config: nautobot config (dict)
+        api_version: api version to use (None = default)
+
+    Returns: pynautobot api
+    """
+    pool_config = get_pool_config(config)
+    logging.debug(f'opening pooled connection to {url} (api_version={api_version}, '
+                  f'pool_maxsize={pool_config.get("pool_maxsize")})')
+    if api_version is None:
+        nautobot = api(url, token=token)
+    else:
+        nautobot = api(url, token=token, api_version=api_version)
+    nautobot.http_session = get_session(pool_config)
+    return nautobot
@@ -4,10 +4,10 @@ import re
 import sys
 from . import interfaces
 from . import ipam
-from pynautobot import api
 from pynautobot.models.dcim import Devices
 from pynautobot.models.dcim import Interfaces as PyInterfaces
 from pynautobot.models.ipam import IpAddresses
+from pynautobot.core.response import Record
 from .. import devicemanagement as dm
 from . import central
 
@@ -72,7 +72,7 @@ class Device:
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot()
 
     def _get_device_from_nautobot(self, refresh=False):
         logging.debug("-- entering sot/device.py/_get_device_from_nautobot")
@@ -82,7 +82,12 @@ class Device:
         if self._device_obj is None or refresh:
             logging.debug("getting device from sot")
             self.open_nautobot()
-            if self._device_name is not None:
+            # a refresh always reads nautobot; the mirror may lag behind
+            if self._device_name is not None and self._sot.mirror_enabled() and not refresh:
+                logging.debug("getting device from mirror")
+                self._device_obj = self._sot.mirror.as_record('devices',
+                                                              self._sot.mirror.get_device(self._device_name))
+            elif self._device_name is not None:
                 self._device_obj = self._sot.central.get_entity(self._nautobot.dcim.devices,
                                                                 "Device",
                                                                 {'name': self._device_name})
@@ -92,6 +97,24 @@ class Device:
 
         return self._device_obj
 
+    def _get_device_getter(self):
+        """
+        returns the getter used to update or delete the device
+
+        The cached device may be outdated and must not be used to compare
+        the properties. Its ID is used instead (no compare) otherwise the
+        device is read by name.
+        """
+        if self._device_obj is not None:
+            return self._device_obj.id
+        return {'name': self._device_name}
+
+    def _set_device_obj(self, response):
+        """ replaces the cached device by the updated one """
+        if isinstance(response, Record):
+            self._device_obj = response
+        return response
+
     def _get_interface(self, interface):
         if interface not in self._interfaces:
             if self._device_obj is None:
@@ -254,6 +277,183 @@ class Device:
             logging.error(f'could not add interfaces; got exception {exc}')
             return None
 
+    def _get_interface_type(self, name):
+        # the type of LAGs and virtual interfaces is known by the name
+        lower = name.lower()
+        if lower.startswith('port-channel'):
+            return 'lag'
+        if lower.startswith(('vlan', 'loopback', 'tunnel', 'nve', 'bdi')):
+            return 'virtual'
+        return None
+
+    def _get_vlan_id(self, vid, site):
+        index = self._sot.get_vlan_index()
+        try:
+            vlan = index.get(vid, site) or index.get(vid)
+        except (TypeError, ValueError):
+            vlan = None
+        if vlan is None:
+            logging.error(f'unknown VLAN {vid}')
+            return None
+        return str(vlan.id)
+
+    def _get_record_value(self, value):
+        # values like mode are returned as {'value': ..., 'label': ...}
+        if hasattr(value, 'value'):
+            return value.value
+        if isinstance(value, dict):
+            return value.get('value')
+        return value
+
+    def _get_record_id(self, value):
+        if value is None:
+            return None
+        if hasattr(value, 'id'):
+            return str(value.id)
+        if isinstance(value, dict):
+            return str(value.get('id'))
+        return str(value)
+
+    def _get_parsed_interface_properties(self, name, parsed, site):
+        properties = {'name': name,
+                      'description': parsed.get('description', ''),
+                      'enabled': not parsed.get('shutdown', False)}
+        interface_type = self._get_interface_type(name)
+        if interface_type:
+            properties['type'] = interface_type
+        mode = parsed.get('mode')
+        if mode == 'access':
+            properties['mode'] = 'access'
+            vlan = self._get_vlan_id(parsed['vlan'], site) if 'vlan' in parsed else None
+            if vlan is not None:
+                properties['untagged_vlan'] = vlan
+        elif mode == 'trunk':
+            if 'vlans_allowed' in parsed:
+                properties['mode'] = 'tagged'
+                vlans = [self._get_vlan_id(vid, site) for vid in parsed['vlans_allowed']]
+                properties['tagged_vlans'] = sorted([vlan for vlan in vlans if vlan is not None])
+            else:
+                properties['mode'] = 'tagged-all'
+        return properties
+
+    def _get_interface_changes(self, interface, properties):
+        """ returns the properties that differ from the existing interface """
+        changes = {}
+        for key, value in properties.items():
+            if key == 'name':
+                continue
+            current = getattr(interface, key, None)
+            if key == 'tagged_vlans':
+                current = sorted([self._get_record_id(vlan) for vlan in current or []])
+            elif key in ['untagged_vlan', 'lag']:
+                current = self._get_record_id(current)
+            else:
+                current = self._get_record_value(current)
+            if key == 'description':
+                current = current or ''
+            if current != value:
+                changes[key] = value
+        return changes
+
+    def sync_interfaces(self, parser, delete=False, chunk_size=250):
+        """
+        syncs the interfaces of the device with the interfaces of a parsed config
+
+        All existing interfaces are read using one request. Missing interfaces
+        are added using one bulk request, changed interfaces (description,
+        enabled, type, mode, VLANs and LAG) are updated using one bulk PATCH
+        and interfaces that are not part of the config are optionally deleted.
+
+        Args:
+            parser: Configparser or the dict returned by Configparser.get_interfaces()
+            delete: delete interfaces that are not part of the config
+            chunk_size: max. number of interfaces per request
+
+        Returns: dict with the number of added, updated, deleted, unchanged and failed interfaces
+        """
+        logging.debug('-- entering device.py/sync_interfaces')
+        self.open_nautobot()
+        counter = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'failed': 0}
+
+        device = self._get_device_from_nautobot()
+        if device is None:
+            logging.error(f'unknown device {self._device_name}')
+            return None
+        parsed_interfaces = parser.get_interfaces() if hasattr(parser, 'get_interfaces') else parser
+        parsed_interfaces = parsed_interfaces or {}
+        site = device.site.name if device.site is not None else None
+        endpoint = self._nautobot.dcim.interfaces
+
+        existing = {interface.name: interface for interface in endpoint.filter(device_id=device.id)}
+        logging.debug(f'device {self._device_name} has {len(existing)} interface(s)')
+
+        new_interfaces = []
+        updates = {}
+        for name, parsed in parsed_interfaces.items():
+            properties = self._get_parsed_interface_properties(name, parsed, site)
+            if name in existing:
+                changes = self._get_interface_changes(existing[name], properties)
+                if len(changes) > 0:
+                    updates[name] = changes
+            else:
+                interface = dict(interfaces.Interface._interface_default_values)
+                interface.update(self._interface_defaults)
+                interface.update(properties)
+                interface['device'] = device.id
+                new_interfaces.append(interface)
+
+        for i in range(0, len(new_interfaces), chunk_size):
+            chunk = new_interfaces[i:i + chunk_size]
+            try:
+                for interface in endpoint.create(chunk):
+                    existing[interface.name] = interface
+                counter['added'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not add {len(chunk)} interface(s); got exception {exc}')
+                counter['failed'] += len(chunk)
+
+        # the LAG is set after all interfaces were added to know the ID of new LAGs
+        for name, parsed in parsed_interfaces.items():
+            if 'channel_group' not in parsed or name not in existing:
+                continue
+            lag_name = "%s%s" % (parser.get_name('port-channel') if hasattr(parser, 'get_name')
+                                 else 'Port-channel', parsed['channel_group'])
+            lag = existing.get(lag_name)
+            if lag is None:
+                logging.error(f'unknown LAG {lag_name} of interface {name}')
+                continue
+            if self._get_record_id(existing[name].lag) != str(lag.id):
+                updates.setdefault(name, {})['lag'] = str(lag.id)
+
+        new_names = set(interface['name'] for interface in new_interfaces)
+        counter['unchanged'] = len([name for name in parsed_interfaces
+                                    if name not in updates and name not in new_names])
+        updates = [dict(changes, id=existing[name].id) for name, changes in updates.items() if name in existing]
+        for i in range(0, len(updates), chunk_size):
+            chunk = updates[i:i + chunk_size]
+            try:
+                endpoint.update(chunk)
+                counter['updated'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not update {len(chunk)} interface(s); got exception {exc}')
+                counter['failed'] += len(chunk)
+
+        if delete:
+            obsolete = [interface.id for name, interface in existing.items() if name not in parsed_interfaces]
+            for i in range(0, len(obsolete), chunk_size):
+                chunk = obsolete[i:i + chunk_size]
+                try:
+                    endpoint.delete(chunk)
+                    counter['deleted'] += len(chunk)
+                except Exception as exc:
+                    logging.error(f'could not delete {len(chunk)} interface(s); got exception {exc}')
+                    counter['failed'] += len(chunk)
+
+        # the cached interface objects may be outdated now
+        self._interfaces = {}
+        logging.debug(f'synced interfaces of {self._device_name}; {counter}')
+        return counter
+
     # -----===== attributes =====-----
 
     def use_defaults(self, use_defaults):
@@ -399,26 +599,24 @@ class Device:
             logging.info("device %s does not exists" % self._device_name)
             return None
 
-        if convert_to_id:
-            logging.debug("converting properties to IDs")
-            success, error = self._sot.central.get_ids(device_properties)
-            if not success:
-                logging.error(f'could not convert properties to IDs; {error}')
-                return None
-        try:
-            success = nb_device.update(device_properties)
-            logging.debug('device %s updated successfully' % device_properties['name'])
-            return nb_device
-        except Exception as exc:
-            logging.error(f'could not update device; got exception %s' % exc)
-            return None
+        # the device may be cached or read from the mirror; the ID is used to
+        # send the properties without comparing them with outdated values
+        return self._set_device_obj(self._sot.central.update_entity(self._nautobot.dcim.devices,
+                                                                    device_properties,
+                                                                    nb_device.id,
+                                                                    convert_id=convert_to_id))
 
     def delete_device(self):
         logging.debug('-- entering device.py/delete_device')
         self.open_nautobot()
         logging.debug(f'deleting device {self._device_name} from sot')
 
-        return self._sot.central.delete_entity(self._nautobot.dcim.devices, "Device", {'name': self._device_name}, {'name': self._device_name})
+        response = self._sot.central.delete_entity(self._nautobot.dcim.devices,
+                                                   "Device",
+                                                   {'name': self._device_name},
+                                                   self._get_device_getter())
+        self._device_obj = None
+        return response
 
     def set_customfield(self, *unnamed, **named):
         logging.debug('-- entering device.py/set_customfield')
@@ -437,9 +635,9 @@ class Device:
             return self._interfaces[self._last_requested_interface].set_customfield(properties)
         else:
             logging.debug(f'setting custom field {properties} on device {self._device_name}')
-            return self._sot.central.update_entity(self._nautobot.dcim.devices,
-                                                   {'custom_fields': properties},
-                                                   {'name': self._device_name})
+            return self._set_device_obj(self._sot.central.update_entity(self._nautobot.dcim.devices,
+                                                                        {'custom_fields': properties},
+                                                                        self._get_device_getter()))
 
     def set_device_tags(self, new_tags):
         self.add_device_tags(new_tags, True)
@@ -448,6 +646,8 @@ class Device:
         logging.debug('-- entering device.py/add_device_tags')
         self.open_nautobot()
         final_list = []
+        # the device is compared only if it is read by this call
+        getter = self._get_device_getter()
 
         if not set_tag:
             # if the device already exists there may also be tags
@@ -458,24 +658,25 @@ class Device:
 
             for tag in device.tags:
                 new_tags.add(tag.name)
+            getter = device
 
             logging.debug(f'current tags: {device.tags}')
             logging.debug(f'updating tags to {new_tags}')
 
         # check if new tag is known; add id to final list
         for new_tag in new_tags:
-            tag = self._sot.central.get_entity(self._nautobot.extras.tags, "Tag", {'name': new_tag})
-            if tag is None:
+            tag_id = self._sot.resolver.resolve('tag_name', new_tag)
+            if tag_id is None:
                 logging.error(f'unknown tag {new_tag}')
             else:
-                final_list.append(tag.id)
+                final_list.append(tag_id)
 
         if len(final_list) > 0:
             properties = {'tags': list(final_list)}
             logging.debug(f'final list of tags {properties}')
-            return self._sot.central.update_entity(self._nautobot.dcim.devices,
-                                                   properties,
-                                                   {'name': self._device_name})
+            return self._set_device_obj(self._sot.central.update_entity(self._nautobot.dcim.devices,
+                                                                        properties,
+                                                                        getter))
 
     def delete_device_tags(self):
         logging.debug('-- entering device.py/delete_tags')
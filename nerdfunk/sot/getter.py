@@ -1,7 +1,8 @@
 import logging
 import requests
 import json
-from pynautobot import api
+from concurrent.futures import ThreadPoolExecutor
+from . import client
 
 
 class Getter(object):
@@ -10,13 +11,20 @@ class Getter(object):
                         '4': 'dcim.interface',
                         '11': 'ipam.prefix'}
 
+    # endpoints used to resolve IDs that are not cached
+    _id_endpoints = {'site': ('dcim', 'sites'),
+                     'location': ('dcim', 'locations'),
+                     'platform': ('dcim', 'platforms'),
+                     'device_type': ('dcim', 'device_types'),
+                     'device_role': ('dcim', 'device_roles'),
+                     'tag': ('extras', 'tags')}
+
     def __new__(cls, sot):
         cls._instance = None
         cls._sot = None
         cls._nautobot = None
         cls._output_format = None
         cls._use = None
-        cls._cache = {'site':{}, 'vlan': {}, 'tag': {} }
 
         # singleton
         if cls._instance is None:
@@ -37,7 +45,7 @@ class Getter(object):
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot()
 
     def __convert_arguments_to_properties(self, *unnamed, **named):
         """ converts unnamed (dict) and named arguments to a single property dict """
@@ -69,18 +77,10 @@ class Getter(object):
         logging.debug(f'getting vlan: {vid} / {site}')
         self.open_nautobot()
 
-        vlans = self._nautobot.ipam.vlans.filter(vid=vid)
-        for vlan in vlans:
-            try:
-                site_name = vlan.site.name
-            except Exception:
-                site_name = None
-
-            if site_name == site:
-                return vlan
-
-        logging.debug("no VLAN found")
-        return None
+        vlan = self._sot.get_vlan_index().get(vid, site)
+        if vlan is None:
+            logging.debug("no VLAN found")
+        return vlan
 
     # -----===== user command =====-----
 
@@ -89,46 +89,53 @@ class Getter(object):
         self._use = use
         return self
 
-    def load_cache(self):
-        all_tags = self.query(name='all_tags', 
-                                output_format='dict',
-                                query_params={})
-        vlans_and_sites = self.query(name='all_vlans_and_sites', 
-                                output_format='dict',
-                                query_params={})
-
-        for tag in all_tags['data']['tags']:
-            slug = tag['slug']
-            tag_id = tag['id']
-            scopes = tag['content_types']
-            for scope in scopes:
-                scope_id = scope['id']
+    def _get_cache(self):
+        return self._sot.get_id_cache()
+
+    def load_cache(self, force=False):
+        logging.debug("-- entering getter.py/load_cache")
+        cache = self._get_cache()
+        if not force and cache.get('_meta', 'warmup'):
+            logging.debug(f'id cache is already warm')
+            return
+
+        config = self._sot.get_config()
+        if config['nautobot'].get('id_cache'):
+            # one query to get sites, locations, vlans, tags, platforms, device types and roles
+            data = self.query(name='id_cache', output_format='dict', query_params={})['data']
+        else:
+            data = self.query(name='all_tags', output_format='dict', query_params={})['data']
+            data.update(self.query(name='all_vlans_and_sites', output_format='dict', query_params={})['data'])
+
+        tags = {}
+        tag_names = {}
+        for tag in data.get('tags', []):
+            if 'name' in tag:
+                tag_names[tag['name']] = tag['id']
+            for scope in tag.get('content_types', []):
                 # scope_id: 4 interface
                 # scope_id: 3 device
-                scope_name = self.scope_id_to_name.get(scope_id, scope_id)
-                if scope_name not in self._cache['tag']:
-                    self._cache['tag'][scope_name] = {}
-                self._cache['tag'][scope_name][slug] = tag_id
+                scope_name = self.scope_id_to_name.get(scope['id'], scope['id'])
+                tags[(scope_name, tag['slug'])] = tag['id']
+        cache.set_many('tag', tags)
+        cache.set_many('tag_name', tag_names)
 
-        for vlan in vlans_and_sites['data']['vlans']:
+        vlans = {}
+        for vlan in data.get('vlans', []):
             site = vlan.get('site')
-            if site:
-                site_name = site['name']
-            else:
-                site_name = None
-            vlan_vid = vlan['vid']
-            vlan_name = vlan['name']
-            vlan_id = vlan['id']
-            if site_name not in self._cache['vlan']:
-                self._cache['vlan'][site_name] = {}
-            self._cache['vlan'][site_name][vlan_vid] = vlan_id
-
-        for site in vlans_and_sites['data']['sites']:
-            site_name = site.get('name')
-            site_id = site.get('id')
-            if site_name not in self._cache['site']:
-                self._cache['site'][site_name] = {}
-            self._cache['site'][site_name] = site_id
+            site_name = site['name'] if site else None
+            vlans[(site_name, int(vlan['vid']))] = vlan['id']
+        cache.set_many('vlan', vlans)
+
+        cache.set_many('site', {site['name']: site['id'] for site in data.get('sites', [])})
+        for kind, key, items in [('location', 'slug', 'locations'),
+                                 ('platform', 'slug', 'platforms'),
+                                 ('device_type', 'slug', 'device_types'),
+                                 ('device_role', 'slug', 'device_roles')]:
+            cache.set_many(kind, {item[key]: item['id'] for item in data.get(items, [])})
+
+        cache.set('_meta', 'warmup', True)
+        logging.debug(f'id cache loaded; {cache.stats()["size"]}')
 
     def device(self, *unnamed, **named):
         logging.debug("-- entering getter.py/device")
@@ -222,9 +229,87 @@ class Getter(object):
         else:
             return devices
 
-    def query(self, *unnamed, **named):
-        logging.debug("-- entering getter.py/query")
-        properties = self.__convert_arguments_to_properties(*unnamed, **named)
+    def _get_page(self, url, params=None):
+        headers = {'Authorization': f'Token {self._sot.get_token()}',
+                   'Accept': 'application/json'}
+        response = self._nautobot.http_session.get(url, params=params, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    def stream(self, page_size=None, prefetch=True, endpoint='dcim.devices', output_format=None, **filter):
+        """
+        yields the filtered records page by page
+
+        Only one page (plus the prefetched next one) is held in memory.
+
+        Args:
+            page_size: number of records per page (default: page_size of the pool config)
+            prefetch: get the next page while the current one is consumed
+            endpoint: endpoint to query (default: dcim.devices)
+            output_format: overrides the output format of the getter
+            **filter: filter (see filter)
+
+        Yields: Record if output format is obj, dict otherwise
+        """
+        logging.debug(f'streaming list of {endpoint} from sot using {filter}')
+        self.open_nautobot()
+        if page_size is None:
+            page_size = client.get_pool_config(self._sot.get_config()['nautobot']).get('page_size')
+        app, name = endpoint.split('.')
+        nb_endpoint = getattr(getattr(self._nautobot, app), name)
+        as_object = (output_format or self._output_format) == "obj"
+
+        params = dict(filter)
+        params.update({'limit': page_size, 'offset': 0})
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = self._get_page("%s/" % nb_endpoint.url, params)
+            while page is not None:
+                next_page = None
+                next_url = page.get('next')
+                if next_url and prefetch:
+                    next_page = executor.submit(self._get_page, next_url)
+                for item in page.get('results', []):
+                    if as_object:
+                        yield nb_endpoint.return_obj(item, self._nautobot, nb_endpoint)
+                    else:
+                        yield item
+                if next_page is not None:
+                    page = next_page.result()
+                elif next_url:
+                    page = self._get_page(next_url)
+                else:
+                    page = None
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def write_jsonl(self, filename, page_size=None, endpoint='dcim.devices', **filter):
+        """
+        writes the filtered records as JSON lines (one record per line) to a file
+
+        Args:
+            filename: name of the file or file object
+            page_size: number of records per page
+            endpoint: endpoint to query (default: dcim.devices)
+            **filter: filter (see filter)
+
+        Returns: number of records written
+        """
+        logging.debug(f'writing {endpoint} to {filename}')
+        counter = 0
+        f = open(filename, 'w') if isinstance(filename, str) else filename
+        try:
+            for item in self.stream(page_size=page_size, endpoint=endpoint, output_format='dict', **filter):
+                f.write(json.dumps(item))
+                f.write('\n')
+                counter += 1
+        finally:
+            if isinstance(filename, str):
+                f.close()
+        return counter
+
+    def _get_query(self, properties):
         query = None
         query_params = None
 
@@ -233,7 +318,7 @@ class Getter(object):
             query = config['nautobot'].get(properties['name'])
             if query is None:
                 logging.error("unkown query %s" % properties['name'])
-                return None
+                return None, None
         if 'query' in properties:
             query = properties.get('query')
         if 'query_params' in properties:
@@ -244,8 +329,119 @@ class Getter(object):
             query = query.replace('name__ie', self._use)
             self._use = None
 
+        return query, query_params
+
+    def _is_paginated(self, query, query_params, properties):
+        # queries that declare $limit and $offset are paginated automatically
+        if not properties.get('paginate', True):
+            return False
+        if '$limit' not in query or '$offset' not in query:
+            return False
+        if query_params and ('limit' in query_params or 'offset' in query_params):
+            # the user wants to get one specific page
+            return False
+        return True
+
+    def _query_page(self, query, query_params, limit, offset):
+        variables = dict(query_params or {})
+        variables.update({'limit': limit, 'offset': offset})
+        return self._nautobot.graphql.query(query=query, variables=variables).json
+
+    def _get_pages(self, query, query_params, page_size, concurrency):
+        """ yields the pages of a paginated query; up to concurrency pages are fetched at once """
+        offset = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = []
+            done = False
+            while not done:
+                while len(pending) < concurrency:
+                    pending.append(executor.submit(self._query_page, query, query_params, page_size, offset))
+                    offset += page_size
+                page = pending.pop(0).result()
+                if 'errors' in page:
+                    logging.error(f'got errors {page["errors"]}')
+                    done = True
+                # the last page is reached if all lists are shorter than page_size
+                lists = [v for v in (page.get('data') or {}).values() if isinstance(v, list)]
+                if all(len(v) < page_size for v in lists):
+                    done = True
+                yield page
+            for future in pending:
+                future.cancel()
+
+    def query_pages(self, *unnamed, **named):
+        """
+        yields the response of a named query page by page
+
+        The query must declare the variables $limit and $offset and use them
+        on its lists (see device_properties in config.yaml.example). Queries
+        without these variables are sent once.
+
+        Args:
+            name or query: the named query or the query itself
+            query_params: variables of the query
+            page_size: number of items per page (default: page_size of the pool config)
+            concurrency: number of pages fetched at once (default: 4)
+
+        Yields: response of each page (dict)
+        """
+        logging.debug("-- entering getter.py/query_pages")
+        properties = self.__convert_arguments_to_properties(*unnamed, **named)
+        query, query_params = self._get_query(properties)
+        if query is None:
+            return
         self.open_nautobot()
-        response = self._nautobot.graphql.query(query=query, variables=query_params).json
+
+        if not self._is_paginated(query, query_params, properties):
+            yield self._nautobot.graphql.query(query=query, variables=query_params).json
+            return
+
+        page_size = properties.get('page_size')
+        if page_size is None:
+            page_size = client.get_pool_config(self._sot.get_config()['nautobot']).get('page_size')
+        concurrency = properties.get('concurrency', 4)
+        logging.debug(f'paginated query; page_size={page_size} concurrency={concurrency}')
+        yield from self._get_pages(query, query_params, page_size, concurrency)
+
+    def query(self, *unnamed, **named):
+        logging.debug("-- entering getter.py/query")
+        properties = self.__convert_arguments_to_properties(*unnamed, **named)
+        query, query_params = self._get_query(properties)
+        if query is None:
+            return None
+
+        # responses of named queries can be cached (see querycache.py)
+        query_cache = None
+        name = properties.get('name')
+        config = self._sot.get_config()['nautobot']
+        if properties.get('cache', (config.get('query_cache') or {}).get('enabled')):
+            # modified queries (query or use) are not cached
+            if query == config.get(name) and self._sot.get_query_cache().is_cacheable(name):
+                query_cache = self._sot.get_query_cache()
+        cached_response = query_cache.get(name, query_params) if query_cache else None
+
+        self.open_nautobot()
+        if cached_response is not None:
+            response = cached_response
+        elif self._is_paginated(query, query_params, properties):
+            page_size = properties.get('page_size')
+            if page_size is None:
+                page_size = client.get_pool_config(self._sot.get_config()['nautobot']).get('page_size')
+            response = None
+            # merge the lists of each page into the response of the first page
+            for page in self._get_pages(query, query_params, page_size, properties.get('concurrency', 4)):
+                if response is None:
+                    response = page
+                    continue
+                for key, value in (page.get('data') or {}).items():
+                    if isinstance(value, list) and isinstance((response.get('data') or {}).get(key), list):
+                        response['data'][key].extend(value)
+                if 'errors' in page:
+                    response['errors'] = page['errors']
+        else:
+            response = self._nautobot.graphql.query(query=query, variables=query_params).json
+        if query_cache is not None and cached_response is None:
+            query_cache.set(name, query_params, response)
 
         if 'output_format' in properties:
             output_format = properties.get('output_format')
@@ -271,58 +467,50 @@ class Getter(object):
         del named['item']
         logging.debug(f'-- entering getter.py/id')
         logging.debug(f'getting id of {item}; parameter {named}')
+        cache = self._get_cache()
 
-        if item == "site":
-            site_name = named.get('name')
-            if site_name in self._cache['site']:
-                logging.debug(f'getting id from cache')
-                return self._cache['site'][site_name]
-            try:
-                site = self._nautobot.dcim.sites.get(**named)
-                if site:
-                    logging.debug(f'adding {site.id} to cache')
-                    self._cache['site'][site_name] = site.id
-                    return site.id
-                else:
-                    logging.error(f'unknown site {site_name}')
-            except Exception as exc:
-                logging.error(f'got exception {exc}')
-                return None
-        elif item =="vlan":
-            vid = named.get('vid')
+        if item == "vlan":
+            vid = int(named.get('vid'))
             site_name = named.get('site')
-            id = self._cache['vlan'].get(site_name, {}).get(vid, None)
+            id = cache.get('vlan', (site_name, vid))
             if id:
                 logging.debug(f'using cached id')
                 return id
-            else:
-                vlan = self._get_vlan(vid, site_name)
-                if vlan is None:
-                    return None
-                else:
-                    if site_name not in self._cache['vlan']:
-                        self._cache['vlan'][site_name] = {}
-                    self._cache['vlan'][site_name][vid] = vlan.id
-                    return vlan.id
-        elif item =="tag":
+            vlan = self._get_vlan(vid, site_name)
+            if vlan is None:
+                return None
+            cache.set('vlan', (site_name, vid), vlan.id)
+            return vlan.id
+
+        if item == "tag":
             slug = named.get('slug')
             content_types = named.get('content_types')
-            id = self._cache['tag'].get(content_types, {}).get(slug, None)
-            if id:
-                logging.debug(f'using cached id')
-                return id
-            try:
-                tag = self._nautobot.extras.tags.get(**named)
-                if tag:
-                    logging.debug(f'adding {content_types} {tag.id} to cache')
-                    self._cache['tag'][content_types] = tag.id
-                    return tag.id
-                else:
-                    logging.error(f'unknown tag {slug}')
-                    return None
-            except Exception as exc:
-                logging.error(f'got exception {exc}')
+            key = (content_types, slug)
+        elif item == "site":
+            key = named.get('name')
+        elif item in self._id_endpoints:
+            key = named.get('slug')
+        else:
+            logging.error(f'unknown item {item}')
+            return None
+
+        id = cache.get(item, key)
+        if id:
+            logging.debug(f'using cached id')
+            return id
+        try:
+            app, endpoint = self._id_endpoints[item]
+            entity = getattr(getattr(self._nautobot, app), endpoint).get(**named)
+            if entity:
+                logging.debug(f'adding {item} {key} {entity.id} to cache')
+                cache.set(item, key, entity.id)
+                return entity.id
+            else:
+                logging.error(f'unknown {item} {key}')
                 return None
+        except Exception as exc:
+            logging.error(f'got exception {exc}')
+            return None
 
     def changes(self, *unnamed, **named):
         logging.debug(f'-- entering getter.py/changes')
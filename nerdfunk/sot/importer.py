@@ -1,16 +1,43 @@
 import logging
 import json
 import os
+import re
+import threading
 import yaml
-from pynautobot import api
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 class Importer(object):
 
+    # references of an endpoint; property: endpoint the property refers to
+    _references = {'platforms': {'manufacturer': 'manufacturers'},
+                   'device_types': {'manufacturer': 'manufacturers'},
+                   'interface_templates': {'device_type': 'device_types'},
+                   'console_port_templates': {'device_type': 'device_types'},
+                   'power_port_templates': {'device_type': 'device_types'},
+                   'device_bay_templates': {'device_type': 'device_types'},
+                   'location_types': {'parent': 'location_types'},
+                   'locations': {'location_type': 'location_types',
+                                 'site': 'sites',
+                                 'parent': 'locations'},
+                   'custom_field_choices': {'field': 'custom_fields'},
+                   'prefixes': {'site': 'sites', 'location': 'locations'},
+                   'devices': {'device_type': 'device_types',
+                               'device_role': 'device_roles',
+                               'platform': 'platforms',
+                               'site': 'sites',
+                               'location': 'locations'}}
+    # endpoints every other endpoint depends on; items may use tags and custom fields
+    _implicit_dependencies = ['tags', 'custom_fields']
+    _no_implicit_dependencies = ['custom_fields', 'custom_field_choices', 'webhooks']
+    _REGEX_UUID = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+    # key used to reference an item; default is slug
+    _natural_keys = {'custom_fields': 'name'}
+
     def __init__(self, sot):
         logging.debug(f'Creating IMPORTER object;')
         self._sot = sot
-        self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token(), api_version=1.3)
+        self._nautobot = self._sot.get_nautobot(api_version=1.3)
 
         self._endpoints = {'sites': self._nautobot.dcim.sites,
                            'manufacturers': self._nautobot.dcim.manufacturers,
@@ -38,7 +65,7 @@ class Importer(object):
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot(api_version=1.3)
 
     def __convert_arguments_to_properties(self, *unnamed, **named):
         """ converts unnamed (dict) and named arguments to a single property dict """
@@ -75,12 +102,119 @@ class Importer(object):
                 return None
         return content
 
-    def import_data(self, data, title, creator, bulk=False):
+    def read_file(self, filename, endpoint=None):
+        """
+        reads a YAML or JSON-lines file item by item
+
+        Each YAML document is either a dict of endpoint: list of items or
+        a list of items of endpoint. A JSON-lines file contains one item per
+        line; the endpoint is either the key 'endpoint' of the item or endpoint.
+
+        Yields: (endpoint, item)
+        """
+        logging.debug(f'reading file {filename}')
+        with open(filename) as f:
+            if filename.endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        yield item.pop('endpoint', endpoint), item
+                return
+            # documents are parsed one after another
+            for document in yaml.safe_load_all(f):
+                if isinstance(document, dict):
+                    for name, items in document.items():
+                        if endpoint is not None and name != endpoint:
+                            continue
+                        for item in items or []:
+                            yield name, item
+                elif isinstance(document, list):
+                    for item in document:
+                        yield endpoint, item
+
+    def import_items(self, items, chunk_size=None, max_workers=None):
+        """
+        adds items to nautobot using chunks that are sent concurrently
+
+        The items are grouped by endpoint. Each chunk is sent using one
+        request; a chunk that fails is retried item by item. The chunks of
+        one endpoint are sent concurrently. When the endpoint changes all
+        chunks of the previous endpoints are finished first to keep the
+        order of the file (eg. manufacturers before device types).
+
+        Args:
+            items: iterable of (endpoint, item) eg. read_file()
+            chunk_size: max. number of items per request (config: nautobot.bulk.chunk_size)
+            max_workers: max. number of concurrent requests (config: nautobot.bulk.max_workers)
+
+        Returns: dict with the number of added and failed items and a list
+                 of results {'endpoint', 'properties', 'success', 'id' or 'error'}
+                 in the order of the items
+        """
+        logging.debug("-- entering importer.py/import_items")
+        self.open_nautobot()
+        config = self._sot.central.get_bulk_config()
+        chunk_size = chunk_size or config['chunk_size']
+        max_workers = max_workers or config['max_workers']
+
+        futures = []
+        buffers = {}
+        # bounds the number of chunks that are read but not sent yet
+        slots = threading.BoundedSemaphore(max_workers * 2)
+        last_endpoint = None
+
+        def send(executor, endpoint, chunk):
+            slots.acquire()
+            future = executor.submit(self._sot.central.add_chunk, self._endpoints[endpoint], chunk)
+            future.add_done_callback(lambda f: slots.release())
+            futures.append((endpoint, chunk, future))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for endpoint, item in items:
+                if endpoint not in self._endpoints:
+                    logging.error(f'unknown endpoint {endpoint}')
+                    futures.append((endpoint, [item], None))
+                    continue
+                if endpoint != last_endpoint and last_endpoint is not None:
+                    # send the rest of the previous endpoint and wait until it is added
+                    for name, chunk in buffers.items():
+                        if len(chunk) > 0:
+                            send(executor, name, chunk)
+                    buffers = {}
+                    wait([f for e, c, f in futures if f is not None])
+                last_endpoint = endpoint
+                buffers.setdefault(endpoint, []).append(item)
+                if len(buffers[endpoint]) >= chunk_size:
+                    send(executor, endpoint, buffers[endpoint])
+                    buffers[endpoint] = []
+            for name, chunk in buffers.items():
+                if len(chunk) > 0:
+                    send(executor, name, chunk)
+
+        response = {'added': 0, 'failed': 0, 'results': []}
+        for endpoint, chunk, future in futures:
+            results = future.result() if future is not None else [(False, 'unknown endpoint')] * len(chunk)
+            for properties, (success, item) in zip(chunk, results):
+                if success:
+                    response['added'] += 1
+                    response['results'].append({'endpoint': endpoint, 'properties': properties,
+                                                'success': True, 'id': item.id})
+                else:
+                    response['failed'] += 1
+                    response['results'].append({'endpoint': endpoint, 'properties': properties,
+                                                'success': False, 'error': item})
+        logging.info(f'added {response["added"]} item(s) to sot; {response["failed"]} failed')
+        return response
+
+    def import_data(self, data, title, creator, bulk=False, chunk_size=None, max_workers=None):
         logging.debug("-- entering importer.py/import_data")
         self.open_nautobot()
         success = False
 
-        if bulk:
+        if bulk and title in self._endpoints:
+            # title is the name of the endpoint; the items are added in chunks
+            return self.import_items([(title, item) for item in data], chunk_size, max_workers)
+        elif bulk:
             success = self._sot.central.add_entity(creator, data)
             if success:
                 logging.info(f'{title} successfully added to sot')
@@ -95,6 +229,127 @@ class Importer(object):
                     logging.error(f'could not add {title} to sot')
         return success
 
+    def _read_plan(self, filename):
+        """ reads all documents of a YAML or JSON file into one dict of endpoint: items """
+        data = {}
+        if filename.endswith('.json'):
+            with open(filename) as f:
+                documents = [json.load(f)]
+        else:
+            documents = []
+            for endpoint, item in self.read_file(filename):
+                data.setdefault(endpoint, []).append(item)
+        for document in documents:
+            for endpoint, items in document.items():
+                data.setdefault(endpoint, []).extend(items or [])
+        return data
+
+    def _get_dependencies(self, endpoints):
+        """ returns dict of endpoint: set of endpoints of the plan it depends on """
+        dependencies = {}
+        for endpoint in endpoints:
+            refs = list(self._references.get(endpoint, {}).values())
+            if endpoint not in self._no_implicit_dependencies:
+                refs.extend(self._implicit_dependencies)
+            dependencies[endpoint] = set(ref for ref in refs if ref in endpoints and ref != endpoint)
+        return dependencies
+
+    def _get_key(self, endpoint, item):
+        return item.get(self._natural_keys.get(endpoint, 'slug'))
+
+    def _resolve_reference(self, ref, value, created):
+        key = value.get(self._natural_keys.get(ref, 'slug')) if isinstance(value, dict) else value
+        if isinstance(key, str) and key in created.get(ref, {}):
+            return created[ref][key]
+        if isinstance(value, str) and not re.match(self._REGEX_UUID, value):
+            # not created by this plan; let nautobot look it up
+            return {self._natural_keys.get(ref, 'slug'): value}
+        return value
+
+    def _resolve_references(self, endpoint, item, created):
+        """ replaces slugs of referenced objects that were created by the plan by their IDs """
+        item = dict(item)
+        for prop, ref in self._references.get(endpoint, {}).items():
+            if prop in item:
+                item[prop] = self._resolve_reference(ref, item[prop], created)
+        # custom fields are keyed by name and need no conversion
+        if isinstance(item.get('tags'), list):
+            item['tags'] = [self._resolve_reference('tags', tag, created) for tag in item['tags']]
+        return item
+
+    def _get_levels(self, endpoint, items):
+        """
+        splits the items of a self-referencing endpoint (eg. locations) into
+        levels; parents are always part of an earlier level
+        """
+        parent_prop = [prop for prop, ref in self._references.get(endpoint, {}).items() if ref == endpoint]
+        if len(parent_prop) == 0:
+            return [items]
+        parent_prop = parent_prop[0]
+        keys = set(self._get_key(endpoint, item) for item in items)
+        levels = []
+        done = set()
+        remaining = list(items)
+        while len(remaining) > 0:
+            level = []
+            for item in remaining:
+                parent = item.get(parent_prop)
+                if isinstance(parent, dict):
+                    parent = parent.get(self._natural_keys.get(endpoint, 'slug'))
+                if parent is None or parent not in keys or parent in done:
+                    level.append(item)
+            if len(level) == 0:
+                logging.error(f'circular references of {endpoint}; adding {len(remaining)} item(s) anyway')
+                level = remaining
+            levels.append(level)
+            done.update(self._get_key(endpoint, item) for item in level)
+            in_level = set(id(item) for item in level)
+            remaining = [item for item in remaining if id(item) not in in_level]
+        return levels
+
+    def _run_endpoint(self, endpoint, items, created, lock, executor, chunk_size):
+        """ adds all items of an endpoint; returns the list of results """
+        logging.debug(f'adding {len(items)} {endpoint}')
+        results = []
+        for level in self._get_levels(endpoint, items):
+            with lock:
+                level = [self._resolve_references(endpoint, item, created) for item in level]
+            chunks = [level[i:i + chunk_size] for i in range(0, len(level), chunk_size)]
+            futures = [executor.submit(self._sot.central.add_chunk, self._endpoints[endpoint], chunk)
+                       for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                for properties, (success, item) in zip(chunk, future.result()):
+                    if success:
+                        key = self._get_key(endpoint, properties)
+                        if key is not None:
+                            with lock:
+                                created.setdefault(endpoint, {})[key] = item.id
+                        results.append({'endpoint': endpoint, 'properties': properties,
+                                        'success': True, 'id': item.id})
+                    else:
+                        results.append({'endpoint': endpoint, 'properties': properties,
+                                        'success': False, 'error': item})
+        return results
+
+    def get_plan(self, endpoints):
+        """
+        returns the order an import plan uses
+
+        Returns: list of lists of endpoints; the endpoints of one list do
+                 not depend on each other
+        """
+        dependencies = self._get_dependencies(endpoints)
+        waves = []
+        done = set()
+        while len(done) < len(dependencies):
+            wave = sorted(e for e, deps in dependencies.items() if e not in done and deps.issubset(done))
+            if len(wave) == 0:
+                logging.error(f'circular dependencies between {set(dependencies) - done}')
+                break
+            waves.append(wave)
+            done.update(wave)
+        return waves
+
     # -----===== user commands =====----- 
 
     def add(self, *unnamed, **named):
@@ -106,9 +361,82 @@ class Importer(object):
             logging.error(f'please specify endpoint')
             return False
         bulk=properties.get('bulk', False)
+        chunk_size = properties.get('chunk_size')
+        max_workers = properties.get('max_workers')
 
         if 'file' in properties:
-            content = self.open_file(properties['file'])
-            return self.import_data(content['interface_templates'], endpoint, self._endpoints[endpoint])
+            # the file is read item by item and the items are added in chunks
+            return self.import_items(self.read_file(properties['file'], endpoint), chunk_size, max_workers)
         elif 'properties' in properties:
-            return self.import_data(properties['properties'], endpoint, self._endpoints[endpoint], bulk=bulk)
+            return self.import_data(properties['properties'], endpoint, self._endpoints[endpoint], bulk=bulk,
+                                    chunk_size=chunk_size, max_workers=max_workers)
+
+    def import_plan(self, *unnamed, **named):
+        """
+        adds the items of many endpoints in the order of their dependencies
+
+        The dependencies between the endpoints of the plan (manufacturers
+        before device types before templates, location types before
+        locations ...) are built using _references. Tags and custom fields
+        are added before all endpoints that may use them. An endpoint starts as
+        soon as all endpoints it depends on are finished; independent
+        endpoints are added concurrently. References by slug (or name) to
+        objects created by the plan are replaced by their IDs without
+        sending a request.
+
+        Args:
+            file: YAML or JSON file with endpoint: list of items
+            data: dict of endpoint: list of items
+            chunk_size: max. number of items per request (config: nautobot.bulk.chunk_size)
+            max_workers: max. number of concurrent requests (config: nautobot.bulk.max_workers)
+
+        Returns: dict with the number of added and failed items, the plan and
+                 the results of each endpoint
+        """
+        logging.debug("-- entering importer.py/import_plan")
+        self.open_nautobot()
+        properties = self.__convert_arguments_to_properties(*unnamed, **named)
+        config = self._sot.central.get_bulk_config()
+        chunk_size = properties.get('chunk_size') or config['chunk_size']
+        max_workers = properties.get('max_workers') or config['max_workers']
+
+        if 'file' in properties:
+            data = self._read_plan(properties['file'])
+        else:
+            data = properties.get('data') or {}
+        unknown = [endpoint for endpoint in data if endpoint not in self._endpoints]
+        for endpoint in unknown:
+            logging.error(f'unknown endpoint {endpoint}; skipping {len(data[endpoint])} item(s)')
+        data = {endpoint: items for endpoint, items in data.items() if endpoint not in unknown}
+
+        dependencies = self._get_dependencies(data.keys())
+        response = {'added': 0, 'failed': 0, 'plan': self.get_plan(data.keys()), 'results': {}}
+        created = {}
+        lock = threading.Lock()
+        running = {}
+        done = set()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as chunk_executor, \
+                ThreadPoolExecutor(max_workers=max(1, len(data))) as endpoint_executor:
+            while len(done) < len(data):
+                # start all endpoints whose dependencies are finished
+                for endpoint, deps in dependencies.items():
+                    if endpoint not in done and endpoint not in running and deps.issubset(done):
+                        running[endpoint] = endpoint_executor.submit(self._run_endpoint, endpoint, data[endpoint],
+                                                                     created, lock, chunk_executor, chunk_size)
+                if len(running) == 0:
+                    logging.error(f'circular dependencies between {set(data) - done}; stopping import')
+                    break
+                finished, pending = wait(running.values(), return_when=FIRST_COMPLETED)
+                for endpoint, future in list(running.items()):
+                    if future in finished:
+                        del running[endpoint]
+                        done.add(endpoint)
+                        results = future.result()
+                        response['results'][endpoint] = results
+                        failed = len([r for r in results if not r['success']])
+                        response['added'] += len(results) - failed
+                        response['failed'] += failed
+                        logging.info(f'added {len(results) - failed} {endpoint}; {failed} failed')
+
+        return response
@@ -1,8 +1,8 @@
 import logging
 import json
-from pynautobot import api
 from pynautobot.models.dcim import Devices
 from pynautobot.models.dcim import Interfaces
+from pynautobot.core.response import Record
 
 
 class Interface:
@@ -36,18 +36,42 @@ class Interface:
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot()
 
     def _get_interface_from_nautobot(self, refresh=False):
         if self._interface_obj is None or refresh:
             self.open_nautobot()
             logging.debug(f'getting interface {self._interface_name} from device {self._device.name}')
+            # a refresh always reads nautobot; the mirror may lag behind
+            if self._sot.mirror_enabled() and not refresh:
+                self._interface_obj = self._sot.mirror.as_record('interfaces',
+                                                                 self._sot.mirror.get_interface(self._device.id,
+                                                                                                self._interface_name))
+                return self._interface_obj
             self._interface_obj = self._nautobot.dcim.interfaces.get(
                 device_id=self._device.id,
                 name=self._interface_name)
 
         return self._interface_obj
 
+    def _get_interface_getter(self):
+        """
+        returns the getter used to update the interface
+
+        The cached interface may be outdated and must not be used to compare
+        the properties. Its ID is used instead (no compare) otherwise the
+        interface is read by device and name.
+        """
+        if self._interface_obj is not None:
+            return self._interface_obj.id
+        return {'device': self._device.name, 'name': self._interface_name}
+
+    def _set_interface_obj(self, response):
+        """ replaces the cached interface by the updated one """
+        if isinstance(response, Record):
+            self._interface_obj = response
+        return response
+
     def __convert_arguments_to_properties(self, *unnamed, **named):
         """ converts unnamed (dict) and named arguments to a single property dict """
         properties = {}
@@ -168,23 +192,21 @@ class Interface:
         # check if new tag is known; add id to final list
         final_list = []
         for new_tag in list_of_tags:
-            tag = self._sot.central.get_entity(self._nautobot.extras.tags, "Tag", {'name': new_tag})
-            if tag is None:
+            tag_id = self._sot.resolver.resolve('tag_name', new_tag)
+            if tag_id is None:
                 logging.error(f'unknown tag {new_tag}')
             else:
-                final_list.append(tag.id)
+                final_list.append(tag_id)
 
         if len(final_list) > 0 or remove_tags:
             # if remove_tags is True it is possibible to set an empty list
             # in this case ALL tags are removed
             properties = {'tags': list(final_list)}
             logging.debug(f'final list of tags {properties}')
-            # getter to get the interface; we use the device id!
-            getter = {'device_id': self._device.id, 'id': interface.id}
-            logging.debug(f'getter: {getter}')
-            return self._sot.central.update_entity(self._nautobot.dcim.interfaces,
-                                                   properties,
-                                                   getter)
+            # the interface was just read from nautobot; no need to get it again
+            return self._set_interface_obj(self._sot.central.update_entity(self._nautobot.dcim.interfaces,
+                                                                          properties,
+                                                                          interface))
         else:
             logging.debug(f'empty tag list')
             return None
@@ -193,11 +215,11 @@ class Interface:
         logging.debug("-- entering sot/interfaces.py/set_customfield")
         properties = self.__convert_arguments_to_properties(*unnamed, **named)
         self.open_nautobot()
-        return self._sot.central.update_entity(func=self._nautobot.dcim.interfaces,
-                                               properties={'custom_fields': properties},
-                                               getter={'device': self._device.name,
-                                                       'name': self._interface_name},
-                                               convert_id=False)
+        return self._set_interface_obj(self._sot.central.update_entity(
+            func=self._nautobot.dcim.interfaces,
+            properties={'custom_fields': properties},
+            getter=self._get_interface_getter(),
+            convert_id=False))
 
     # -----===== attributes =====-----
 
@@ -225,8 +247,8 @@ class Interface:
         self.open_nautobot()
 
         properties = self.__convert_arguments_to_properties(*unnamed, **named)
-        return self._sot.central.update_entity(func=self._nautobot.dcim.interfaces,
-                                               properties=properties,
-                                               getter={'device': self._device.name,
-                                                       'name': self._interface_name},
-                                               convert_id=False)
+        return self._set_interface_obj(self._sot.central.update_entity(
+            func=self._nautobot.dcim.interfaces,
+            properties=properties,
+            getter=self._get_interface_getter(),
+            convert_id=False))
@@ -1,5 +1,6 @@
 import logging
-from pynautobot import api
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pynautobot.models.dcim import Interfaces
 from pynautobot.models.dcim import Devices
 from pynautobot.models.ipam import IpAddresses
@@ -38,12 +39,6 @@ class Ipam(object):
         cls._last_requested_prefix =  None
         cls._last_requested_site =  None
 
-        # bulk operations
-        cls._bulk = False
-        cls._bulk_insert_ipv4_operation = []
-        cls._bulk_insert_prefixe_operation = []
-        cls._bulk_insert_vlan_operation = []
-
         # ip address to assign an interface
         cls._ipv4_assign_address = None
         cls._make_interface_primary = None
@@ -64,6 +59,11 @@ class Ipam(object):
             cls._instance = super(Ipam, cls).__new__(cls)
             # Put any initialization here
             cls._sot = sot
+            # bulk operations; each sot has its own queues that are
+            # emptied by commit()
+            cls._instance._bulk = False
+            cls._instance._bulk_lock = threading.Lock()
+            cls._instance._bulk_queue = {'ip_addresses': [], 'prefixes': [], 'vlans': []}
 
         return cls._instance
 
@@ -71,7 +71,7 @@ class Ipam(object):
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot()
 
     def __convert_arguments_to_properties(self, *unnamed, **named):
         """ converts unnamed (dict) and named arguments to a single property dict """
@@ -98,6 +98,17 @@ class Ipam(object):
         
         return properties
 
+    def _queue(self, kind, properties):
+        # the IDs are converted now like add_entity does; commit sends the items as they are
+        success, error = self._sot.central.get_ids(properties)
+        if not success:
+            logging.error(f'could not convert items to IDs; {error}; not queued')
+            return None
+        with self._bulk_lock:
+            self._bulk_queue[kind].append(properties)
+            logging.debug(f'{len(self._bulk_queue[kind])} {kind} queued')
+        return properties
+
     # -----===== user commands =====-----
 
     def get(self):
@@ -114,17 +125,19 @@ class Ipam(object):
         if self._last_request == "ipv4":
             properties.update({'address': self._last_requested_ipv4})
             if self._bulk:
-                self._bulk_insert_ipv4_operation.append(properties)
+                if self._use_defaults:
+                    properties.update(self._ipv4_defaults)
+                self._queue('ip_addresses', properties)
             else:
                 return self.add_ipv4(properties)
         if self._last_request == "vlan":
             if self._bulk:
-                self._bulk_vlan_ipv4_operation.append(properties)
+                self._queue('vlans', self._get_vlan_properties(properties))
             else:
                 return self.add_vlan(properties)
         if self._last_request == "prefix":
             if self._bulk:
-                self._bulk_insert_prefixe_operation.append(properties)
+                self._queue('prefixes', self._get_prefix_properties(properties))
             else:
                 return self.add_prefix(properties)
 
@@ -179,34 +192,68 @@ class Ipam(object):
         logging.debug(f'setting PREFIX defaults to {properties}')
         self._prefix_defaults = properties
 
-    def commit(self):
-        logging.debug('-- entering ipam.py/commit')
-        self.open_nautobot()
+    def commit(self, chunk_size=None, max_workers=None):
+        """
+        adds all queued IP addresses, VLANs and prefixes
 
-        if len(self._bulk_insert_ipv4_operation) > 0:
-            logging.debug(f'adding {len(self._bulk_insert_ipv4_operation)} IP addresses(s)')
-            try:
-                nb_interface = self._nautobot.ipam.ip_addresses.create(self._bulk_insert_ipv4_operation)
-                self._bulk_insert_ipv4_operation = []
-            except Exception as exc:
-                logging.error(f'could not add entity; got exception {exc}')
+        The queues are split into chunks; each chunk is sent using one
+        request and up to max_workers chunks are sent concurrently.
 
-        if len(self._bulk_insert_vlan_operation) > 0:
-            logging.debug(f'adding {len(self._bulk_insert_vlan_operation)} VLAN(s)')
-            try:
-                nb_interface = self._nautobot.ipam.vlans.create(self._bulk_insert_vlan_operation)
-                self._bulk_insert_vlan_operation = []
-            except Exception as exc:
-                logging.error(f'could not add entity; got exception {exc}')
+        Args:
+            chunk_size: max. number of items per request (config: nautobot.bulk.chunk_size)
+            max_workers: max. number of concurrent requests (config: nautobot.bulk.max_workers)
+
+        Returns: dict of kind: list of results in the order the items were
+                 added; a result is {'properties', 'success', 'id' or 'error'}
+        """
+        logging.debug('-- entering ipam.py/commit')
+        self.open_nautobot()
+        config = self._sot.central.get_bulk_config()
+        chunk_size = chunk_size or config['chunk_size']
+        max_workers = max_workers or config['max_workers']
+
+        with self._bulk_lock:
+            queues = {kind: list(items) for kind, items in self._bulk_queue.items()}
+            for items in self._bulk_queue.values():
+                items.clear()
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # the chunks of all kinds are sent concurrently
+            futures = []
+            for kind, items in queues.items():
+                if len(items) > 0:
+                    logging.debug(f'adding {len(items)} {kind} using chunks of {chunk_size}')
+                endpoint = getattr(self._nautobot.ipam, kind)
+                for i in range(0, len(items), chunk_size):
+                    chunk = items[i:i + chunk_size]
+                    futures.append((kind, chunk, executor.submit(self._sot.central.add_chunk, endpoint, chunk)))
+
+            for kind, chunk, future in futures:
+                for properties, (success, item) in zip(chunk, future.result()):
+                    if success:
+                        results.setdefault(kind, []).append({'properties': properties, 'success': True, 'id': item.id})
+                        if kind == 'vlans':
+                            self._sot.get_vlan_index().add(item)
+                    else:
+                        results.setdefault(kind, []).append({'properties': properties, 'success': False, 'error': item})
+
+        for kind, response in results.items():
+            failed = len([r for r in response if not r['success']])
+            logging.debug(f'added {len(response) - failed} {kind}; {failed} failed')
+        return results
+
+    def pending(self):
+        """ returns the number of queued items per kind """
+        with self._bulk_lock:
+            return {kind: len(items) for kind, items in self._bulk_queue.items()}
+
+    def rollback(self):
+        """ removes all queued items """
+        with self._bulk_lock:
+            for items in self._bulk_queue.values():
+                items.clear()
 
-        if len(self._bulk_insert_prefixe_operation) > 0:
-            logging.debug(f'adding {len(self._bulk_insert_prefixe_operation)} prefixe(s)')
-            try:
-                nb_interface = self._nautobot.ipam.prefixes.create(self._bulk_insert_prefixe_operation)
-                self._bulk_insert_prefixe_operation = []
-            except Exception as exc:
-                logging.error(f'could not add entity; got exception {exc}')
-                
     # -----===== attributes =====-----
 
     def device(self, device):
@@ -326,7 +373,7 @@ class Ipam(object):
         ipv4 = self._last_requested_ipv4
 
         if isinstance(ipv4, IpAddresses):
-            getter = {'id': ipv4.id}
+            getter = ipv4
             message = {'address': ipv4.address}
         else:
             getter = {'address': ipv4}
@@ -360,8 +407,7 @@ class Ipam(object):
         elif isinstance(self._last_requested_ipv4, Prefixes):
             return self._last_requested_prefix
 
-    def add_prefix(self, properties):
-        self.open_nautobot()
+    def _get_prefix_properties(self, properties):
         if self._use_defaults:
             logging.debug(f'adding default values to properties')
             properties.update(self._prefix_defaults)
@@ -371,7 +417,11 @@ class Ipam(object):
         else:
             properties.update({'prefix': self._last_requested_prefix,
                                'status': 'active'})
+        return properties
 
+    def add_prefix(self, properties):
+        self.open_nautobot()
+        properties = self._get_prefix_properties(properties)
         logging.debug(f'add prefix: {properties}')
 
         return self._sot.central.add_entity(self._nautobot.ipam.prefixes, properties, True)
@@ -416,24 +466,19 @@ class Ipam(object):
             self._last_requested_vlan = None
             return vlan
 
-        vlans = self._nautobot.ipam.vlans.filter(vid=self._last_requested_vlan)
-        for vlan in vlans:
-            try:
-                site_name = vlan.site.name
-            except Exception:
-                site_name = None
-
-            if site_name == self._last_requested_site:
-                return vlan
+        if self._sot.mirror_enabled():
+            logging.debug("getting vlan from mirror")
+            # the mirror is keyed by site name like the VLAN index
+            site = self._sot.get_vlan_index().get_site_name(self._last_requested_site)
+            return self._sot.mirror.as_record('vlans',
+                                              self._sot.mirror.get_vlan(self._last_requested_vlan, site))
 
-        logging.debug("no VLAN found")
-        return None
+        vlan = self._sot.get_vlan_index().get(self._last_requested_vlan, self._last_requested_site)
+        if vlan is None:
+            logging.debug("no VLAN found")
+        return vlan
 
-    def add_vlan(self, properties):
-        logging.debug(f'-- entering ipam.py/add_vlan')
-        self.open_nautobot()
-        skip = False
-        logging.debug(f'adding VLAN {self._last_requested_vlan} with properties {properties} to sot')
+    def _get_vlan_properties(self, properties):
         if self._use_defaults:
             logging.debug(f'adding default values to properties')
             properties.update(self._vlan_defaults)
@@ -444,24 +489,24 @@ class Ipam(object):
             properties.update({'vid': self._last_requested_vlan,
                                'name': 'vlan-%s' % self._last_requested_vlan,
                                'status': 'active'})
+        return properties
 
-        logging.debug(f'getting all vlans with vid {properties["vid"]}')
-        vlans = self._nautobot.ipam.vlans.filter(vid=properties['vid'])
-        for vlan in vlans:
-            try:
-                site_name = vlan.site
-            except Exception:
-                site_name = None
-
-            logging.debug("checking vlan.vid %s / %s site_name: %s / %s" % \
-                (vlan.vid, properties.get('vid'), site_name, properties.get('site')))
-            if int(vlan.vid) == int(properties.get('vid')) and str(site_name) == str(properties.get('site')):
-                logging.debug(f'VLAN already in sot')
-                skip = True
-            
-        if not skip:
-            message = {'vid': properties.get('vid'), 'site': properties.get('site')}
-            return self._sot.central.add_entity(self._nautobot.ipam.vlans, properties, True)
+    def add_vlan(self, properties):
+        logging.debug(f'-- entering ipam.py/add_vlan')
+        self.open_nautobot()
+        logging.debug(f'adding VLAN {self._last_requested_vlan} with properties {properties} to sot')
+        properties = self._get_vlan_properties(properties)
+
+        index = self._sot.get_vlan_index()
+        site = index.get_site_name(properties.get('site'))
+        if index.get(properties['vid'], site) is not None:
+            logging.debug(f'VLAN already in sot')
+            return None
+
+        vlan = self._sot.central.add_entity(self._nautobot.ipam.vlans, properties, True)
+        if vlan:
+            index.add(vlan, (site, int(properties['vid'])))
+        return vlan
 
     def delete_vlan(self):
         self.open_nautobot()
@@ -478,23 +523,20 @@ class Ipam(object):
             vid = properties.get('vid')
             site = properties.get('site')
 
-        vlans = self._nautobot.ipam.vlans.filter(vid=vid)
-        for vlan in vlans:
-            try:
-                site_name = vlan.site.name
-            except Exception:
-                site_name = None
-
-            if site_name == site:
-                message = {'vid': vid, 'site':site_name}
-                return self._sot.central.delete_entity(self._nautobot.ipam.vlans,
-                                             'VLAN',
-                                             vlan,
-                                             {'id': vlan.id})
-
-        logging.debug("no VLAN found")
-        return None
-        
+        index = self._sot.get_vlan_index()
+        vlan = index.get(vid, site)
+        if vlan is None:
+            logging.debug("no VLAN found")
+            return None
+
+        response = self._sot.central.delete_entity(self._nautobot.ipam.vlans,
+                                                   'VLAN',
+                                                   vlan,
+                                                   vlan)
+        if response:
+            index.remove(vlan)
+        return response
+
     def update_vlan(self, properties):
         self.open_nautobot()
         logging.debug(f'update VLAN address: {properties}')
@@ -510,21 +552,133 @@ class Ipam(object):
 
         # there are global and site specific VLANs
         # if site is None it is a global one otherwise site specific
-        vlans = self._nautobot.ipam.vlans.filter(vid=properties['vid'])
-        for vlan in vlans:
+        index = self._sot.get_vlan_index()
+        site = index.get_site_name(properties.get('site'))
+        vlan = index.get(properties['vid'], site)
+        if vlan is None:
+            logging.debug("no VLAN found")
+            return None
+
+        # the record of the index may be outdated; update by ID without comparing
+        entity = self._sot.central.update_entity(self._nautobot.ipam.vlans,
+                                                 properties,
+                                                 vlan.id)
+        if entity:
+            index.update(entity, (site, int(properties['vid'])))
+        return entity
+
+    def sync_vlans(self, site, parsed_vlans, delete=False, chunk_size=None):
+        """
+        syncs the VLANs of a site with the VLANs of a (parsed) config
+
+        All missing VLANs are added using one bulk request, VLANs with a
+        different name are updated using one bulk request and VLANs that
+        are not part of the config are optionally deleted.
+
+        Only the names of the global VLANs of a parsed config are used to
+        name or rename VLANs. VLANs that are only known by a SVI or a trunk
+        are added as vlan-<vid> and existing VLANs keep their name. The
+        names of a list of VLANs are always used.
+
+        Args:
+            site: name of the site or None for global VLANs
+            parsed_vlans: result of Configparser.get_vlans() or a list of {'vid': vid, 'name': name}
+            delete: delete VLANs of the site that are not part of parsed_vlans
+            chunk_size: max. number of VLANs per request (default: chunk_size of the bulk config)
+
+        Returns: dict with the number of added, updated, deleted, unchanged and failed VLANs
+        """
+        logging.debug(f'-- entering ipam.py/sync_vlans')
+        self.open_nautobot()
+        counter = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'failed': 0}
+        if chunk_size is None:
+            chunk_size = self._sot.central.get_bulk_config().get('chunk_size')
+
+        # get_vlans returns (global_vlans, svi, trunk_vlans); the names of
+        # SVIs and trunks are descriptions and not names of VLANs
+        if isinstance(parsed_vlans, tuple):
+            named = parsed_vlans[0]
+            unnamed = [vlan for vlans in parsed_vlans[1:] for vlan in vlans]
+        else:
+            named = parsed_vlans
+            unnamed = []
+        wanted = {}
+        for vlan, use_name in [(v, True) for v in named] + [(v, False) for v in unnamed]:
             try:
-                site_name = vlan.site
-            except Exception:
-                site_name = None
-
-            if vlan.vid == properties.get('vid') and site_name == properties.get('site'):
-                message = {'vid': properties.get('vid'), 'site': properties.get('site')}
-                return self._sot.central.update_entity(self._nautobot.ipam.vlans,
-                                             properties,
-                                             {'id': vlan.id})
-
-        logging.debug("no VLAN found")
-        return None
+                vid = int(vlan['vid'])
+            except (KeyError, TypeError, ValueError):
+                logging.error(f'cannot use {vlan} as VLAN')
+                counter['failed'] += 1
+                continue
+            # None means the name of the VLAN is unknown; Configparser.get_vlans
+            # uses 'unknown' if the config contains no name
+            name = vlan.get('name') if use_name else None
+            if name == 'unknown':
+                name = None
+            if wanted.get(vid) is None:
+                wanted[vid] = name
+
+        site_id = None
+        if site is not None:
+            site_id = self._sot.resolver.resolve('site', site)
+            if site_id is None:
+                logging.error(f'unknown site {site}')
+                counter['failed'] = len(wanted)
+                return counter
+
+        index = self._sot.get_vlan_index()
+        existing = index.vlans(site)
+        new_vlans = []
+        updates = []
+        for vid, name in wanted.items():
+            vlan = existing.get(vid)
+            if vlan is None:
+                properties = dict(self._vlan_defaults) if self._use_defaults else {'status': 'active'}
+                properties.update({'vid': vid, 'name': name or 'vlan-%s' % vid})
+                if site_id is not None:
+                    properties['site'] = site_id
+                new_vlans.append(properties)
+            elif name is not None and vlan.name != name:
+                updates.append((vlan, name))
+            else:
+                counter['unchanged'] += 1
+        obsolete = [vlan for vid, vlan in existing.items() if vid not in wanted] if delete else []
+
+        endpoint = self._nautobot.ipam.vlans
+        for i in range(0, len(new_vlans), chunk_size):
+            chunk = new_vlans[i:i + chunk_size]
+            try:
+                for vlan in endpoint.create(chunk):
+                    index.add(vlan, (site, int(vlan.vid)))
+                counter['added'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not add {len(chunk)} VLAN(s); got exception {exc}')
+                counter['failed'] += len(chunk)
+
+        for i in range(0, len(updates), chunk_size):
+            chunk = updates[i:i + chunk_size]
+            try:
+                endpoint.update([{'id': vlan.id, 'name': name} for vlan, name in chunk])
+                for vlan, name in chunk:
+                    vlan.name = name
+                counter['updated'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not update {len(chunk)} VLAN(s); got exception {exc}')
+                counter['failed'] += len(chunk)
+
+        for i in range(0, len(obsolete), chunk_size):
+            chunk = obsolete[i:i + chunk_size]
+            try:
+                endpoint.delete([vlan.id for vlan in chunk])
+                for vlan in chunk:
+                    index.remove(vlan)
+                counter['deleted'] += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not delete {len(chunk)} VLAN(s); got exception {exc}')
+                counter['failed'] += len(chunk)
+
+        logging.debug(f'synced VLANs of site {site}; {counter}')
+        return counter
 
     # -----===== IP assignment management =====-----
 
@@ -0,0 +1,281 @@
+import logging
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+class Mirror(object):
+    """
+    local mirror of the nautobot inventory
+
+    The mirror is an indexed sqlite database of devices, interfaces, IP
+    addresses, prefixes, VLANs and tags. After an initial full sync it is
+    kept fresh by reading the object changes (Getter.changes) since the
+    last sync. Only changed objects are fetched again. Reads start the
+    refresh in the background; the mirror may lag behind nautobot by
+    about poll_interval seconds.
+
+    usage:
+        sot.mirror.sync()
+        sot.use_mirror(True)
+        sot.device('lab.local').get()  # served by the mirror
+    """
+
+    # kind: (endpoint, object type, indexed columns)
+    _kinds = {'devices': ('dcim.devices', 'dcim.device', ['name']),
+              'interfaces': ('dcim.interfaces', 'dcim.interface', ['device_id', 'name']),
+              'ip_addresses': ('ipam.ip_addresses', 'ipam.ipaddress', ['address']),
+              'prefixes': ('ipam.prefixes', 'ipam.prefix', ['prefix']),
+              'vlans': ('ipam.vlans', 'ipam.vlan', ['vid', 'site']),
+              'tags': ('extras.tags', 'extras.tag', ['name'])}
+    # changes are read a bit earlier than the last sync to tolerate clock skew
+    _skew = 60
+
+    def __init__(self, sot, filename=None, poll_interval=60):
+        logging.debug(f'Creating MIRROR object; filename={filename}')
+        self._sot = sot
+        self._nautobot = None
+        self._lock = threading.RLock()
+        self._poll_interval = poll_interval
+        self._last_check = 0
+        self._refreshing = False
+        self._filename = os.path.expanduser(filename) if filename else ':memory:'
+        directory = os.path.dirname(self._filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._db = sqlite3.connect(self._filename, check_same_thread=False)
+        self._create_tables()
+
+    # -----===== internals =====-----
+
+    def open_nautobot(self):
+        if self._nautobot is None:
+            self._nautobot = self._sot.get_nautobot()
+
+    def _create_tables(self):
+        for kind, (endpoint, object_type, columns) in self._kinds.items():
+            self._db.execute('CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, %s, data TEXT)' %
+                             (kind, ', '.join(['%s TEXT' % c for c in columns])))
+            self._db.execute('CREATE INDEX IF NOT EXISTS %s_idx ON %s (%s)' %
+                             (kind, kind, ', '.join(columns)))
+        self._db.execute('CREATE TABLE IF NOT EXISTS mirror_meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._db.commit()
+
+    def _get_endpoint(self, kind):
+        app, name = self._kinds[kind][0].split('.')
+        return getattr(getattr(self._nautobot, app), name)
+
+    def _get_columns(self, kind, data):
+        if kind == 'devices':
+            return [data.get('name')]
+        if kind == 'interfaces':
+            return [(data.get('device') or {}).get('id'), data.get('name')]
+        if kind == 'ip_addresses':
+            return [data.get('address')]
+        if kind == 'prefixes':
+            return [data.get('prefix')]
+        if kind == 'vlans':
+            return [str(data.get('vid')), (data.get('site') or {}).get('name')]
+        if kind == 'tags':
+            return [data.get('name')]
+
+    def _store(self, kind, items):
+        columns = self._kinds[kind][2]
+        rows = [[str(data['id'])] + self._get_columns(kind, data) + [json.dumps(data)] for data in items]
+        self._db.executemany('INSERT OR REPLACE INTO %s (id, %s, data) VALUES (%s)' %
+                             (kind, ', '.join(columns), ', '.join(['?'] * (len(columns) + 2))),
+                             rows)
+        return len(rows)
+
+    def _get_last_sync(self):
+        row = self._db.execute("SELECT value FROM mirror_meta WHERE key = 'last_sync'").fetchone()
+        return row[0] if row else None
+
+    def _set_last_sync(self, last_sync):
+        self._db.execute("INSERT OR REPLACE INTO mirror_meta VALUES ('last_sync', ?)", (last_sync,))
+
+    def _get_change_type(self, change):
+        object_type = change.get('changed_object_type')
+        if isinstance(object_type, dict):
+            return "%s.%s" % (object_type.get('app_label'), object_type.get('model'))
+        return object_type
+
+    def _select(self, kind, **where):
+        self._refresh_in_background()
+        sql = 'SELECT data FROM %s WHERE %s' % (kind, ' AND '.join(
+            ['%s IS ?' % key for key in where.keys()]))
+        with self._lock:
+            rows = self._db.execute(sql, list(where.values())).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # -----===== user commands =====-----
+
+    def is_synced(self):
+        with self._lock:
+            return self._get_last_sync() is not None
+
+    def sync(self, page_size=None):
+        """
+        full sync of all kinds; existing data is replaced
+
+        Returns: dict of kind: number of objects or None if the sync failed
+        """
+        logging.debug(f'-- entering mirror.py/sync')
+        now = datetime.now(timezone.utc).isoformat()
+        counter = {}
+        getter = self._sot.get
+        with self._lock:
+            try:
+                # the old data is kept if the sync fails
+                with self._db:
+                    for kind, (endpoint, object_type, columns) in self._kinds.items():
+                        self._db.execute('DELETE FROM %s' % kind)
+                        items = []
+                        counter[kind] = 0
+                        for item in getter.stream(page_size=page_size, endpoint=endpoint, output_format='dict'):
+                            items.append(item)
+                            if len(items) >= 1000:
+                                counter[kind] += self._store(kind, items)
+                                items = []
+                        counter[kind] += self._store(kind, items)
+                    self._set_last_sync(now)
+            except Exception as exc:
+                logging.error(f'could not sync mirror; got exception {exc}')
+                return None
+            self._last_check = time.time()
+        logging.debug(f'mirror synced; {counter}')
+        return counter
+
+    def refresh(self):
+        """
+        applies all object changes since the last sync
+
+        The changes and changed objects are read without holding the lock;
+        reads of the mirror are not blocked by the requests.
+
+        Returns: number of changes applied or None if the mirror was not synced
+                 or the refresh failed
+        """
+        logging.debug(f'-- entering mirror.py/refresh')
+        self.open_nautobot()
+        with self._lock:
+            self._last_check = time.time()
+            last_sync = self._get_last_sync()
+        if last_sync is None:
+            logging.error(f'mirror was never synced; please call sync first')
+            return None
+        start = (datetime.fromisoformat(last_sync) - timedelta(seconds=self._skew)).isoformat()
+        now = datetime.now(timezone.utc).isoformat()
+
+        kinds = {object_type: kind for kind, (endpoint, object_type, columns) in self._kinds.items()}
+        deleted = {}
+        changed = {}
+        items = {}
+        getter = self._sot.get
+        try:
+            changes = getter.changes(start=start) or []
+            for change in changes:
+                kind = kinds.get(self._get_change_type(change))
+                if kind is None:
+                    continue
+                object_id = str(change.get('changed_object_id'))
+                if change.get('action') == 'delete':
+                    deleted.setdefault(kind, set()).add(object_id)
+                    changed.get(kind, set()).discard(object_id)
+                else:
+                    changed.setdefault(kind, set()).add(object_id)
+                    deleted.get(kind, set()).discard(object_id)
+            for kind, ids in changed.items():
+                # get all changed objects of one kind using as few requests as possible
+                items[kind] = []
+                ids_list = list(ids)
+                for i in range(0, len(ids_list), 100):
+                    items[kind].extend(getter.stream(endpoint=self._kinds[kind][0], output_format='dict',
+                                                     id=ids_list[i:i + 100]))
+        except Exception as exc:
+            logging.error(f'could not refresh mirror; got exception {exc}')
+            return None
+
+        with self._lock:
+            try:
+                with self._db:
+                    for kind, ids in deleted.items():
+                        self._db.executemany('DELETE FROM %s WHERE id = ?' % kind, [(i,) for i in ids])
+                    for kind, ids in changed.items():
+                        self._store(kind, items[kind])
+                        missing = ids - set(str(item['id']) for item in items[kind])
+                        self._db.executemany('DELETE FROM %s WHERE id = ?' % kind, [(i,) for i in missing])
+                    self._set_last_sync(now)
+            except Exception as exc:
+                logging.error(f'could not refresh mirror; got exception {exc}')
+                return None
+        logging.debug(f'applied {len(changes)} change(s) to mirror')
+        return len(changes)
+
+    def refresh_if_stale(self):
+        if time.time() - self._last_check > self._poll_interval and self.is_synced():
+            self.refresh()
+
+    def _refresh_in_background(self):
+        """ starts a refresh if the mirror is stale; reads never wait for it """
+        with self._lock:
+            if self._refreshing or time.time() - self._last_check <= self._poll_interval:
+                return
+            if self._get_last_sync() is None:
+                return
+            self._refreshing = True
+            self._last_check = time.time()
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get_device(self, name):
+        devices = self._select('devices', name=name)
+        return devices[0] if len(devices) > 0 else None
+
+    def get_interfaces(self, device_id):
+        return self._select('interfaces', device_id=str(device_id))
+
+    def get_interface(self, device_id, name):
+        interfaces = self._select('interfaces', device_id=str(device_id), name=name)
+        return interfaces[0] if len(interfaces) > 0 else None
+
+    def get_ip_address(self, address):
+        addresses = self._select('ip_addresses', address=address)
+        return addresses[0] if len(addresses) > 0 else None
+
+    def get_prefix(self, prefix):
+        prefixes = self._select('prefixes', prefix=prefix)
+        return prefixes[0] if len(prefixes) > 0 else None
+
+    def get_vlan(self, vid, site=None):
+        vlans = self._select('vlans', vid=str(vid), site=site)
+        return vlans[0] if len(vlans) > 0 else None
+
+    def get_tag(self, name):
+        tags = self._select('tags', name=name)
+        return tags[0] if len(tags) > 0 else None
+
+    def as_record(self, kind, data):
+        """ converts data of the mirror to a pynautobot record """
+        if data is None:
+            return None
+        self.open_nautobot()
+        endpoint = self._get_endpoint(kind)
+        return endpoint.return_obj(data, self._nautobot, endpoint)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
@@ -0,0 +1,223 @@
+import logging
+from . import device
+from . import interfaces
+
+
+class Onboarding(object):
+    """
+    onboards many devices at once
+
+    Instead of adding each device, its primary interface and its primary IP
+    one by one (see Device.add_device) the devices are processed in stages.
+    Each stage sends one list-bodied request per chunk and the IDs that are
+    returned are used by the next stage.
+    """
+
+    # constant values; the same as adding a single device
+    _device_mandatory_properties = device.Device._device_mandatory_properties
+    _device_default_values = device.Device._device_default_values
+    _interface_default_values = interfaces.Interface._interface_default_values
+    # keys of a device spec that are not device properties
+    _spec_keys = ['primary_interface', 'primary_ipv4', 'make_primary']
+
+    def __init__(self, sot):
+        logging.debug(f'Creating ONBOARDING object')
+        self._sot = sot
+        self._nautobot = None
+        self._use_defaults = False
+        self._chunk_size = 250
+        self._requests = 0
+
+    # -----===== internals =====-----
+
+    def open_nautobot(self):
+        if self._nautobot is None:
+            self._nautobot = self._sot.get_nautobot()
+
+    def _chunks(self, items):
+        for i in range(0, len(items), self._chunk_size):
+            yield items[i:i + self._chunk_size]
+
+    def _create(self, endpoint, title, items):
+        """ bulk create items; returns list of created records or None per item """
+        created = []
+        for chunk in self._chunks(items):
+            self._requests += 1
+            try:
+                response = endpoint.create(chunk)
+                logging.debug(f'added {len(chunk)} {title}(s) to sot')
+                created.extend(response)
+            except Exception as exc:
+                logging.error(f'could not add {len(chunk)} {title}(s); got exception {exc}')
+                created.extend([None] * len(chunk))
+        return created
+
+    def _update(self, endpoint, title, items):
+        """ bulk update items; returns True per successfully updated item """
+        updated = []
+        for chunk in self._chunks(items):
+            self._requests += 1
+            try:
+                endpoint.update(chunk)
+                logging.debug(f'updated {len(chunk)} {title}(s) in sot')
+                updated.extend([True] * len(chunk))
+            except Exception as exc:
+                logging.error(f'could not update {len(chunk)} {title}(s); got exception {exc}')
+                updated.extend([False] * len(chunk))
+        return updated
+
+    def _get_device_properties(self, spec):
+        properties = {k: v for k, v in spec.items() if k not in self._spec_keys}
+        for key in self._device_mandatory_properties:
+            if key not in properties:
+                if self._use_defaults:
+                    logging.error(f'mandatory property {key} of {properties.get("name")} is missing; using default')
+                    properties[key] = self._device_default_values.get(key)
+                else:
+                    logging.error(f'mandatory property {key} of {properties.get("name")} is missing')
+                    return None
+        return properties
+
+    def _get_interface_properties(self, spec, device_id):
+        primary_interface = spec.get('primary_interface')
+        if isinstance(primary_interface, dict):
+            properties = dict(primary_interface)
+        else:
+            properties = {'name': primary_interface}
+        for key, value in self._interface_default_values.items():
+            if key not in properties:
+                properties[key] = value
+        properties['device'] = device_id
+        return properties
+
+    # -----===== attributes =====-----
+
+    def use_defaults(self, use_defaults):
+        logging.debug(f'setting use_defaults to {use_defaults} (onboarding)')
+        self._use_defaults = use_defaults
+        return self
+
+    def chunk_size(self, chunk_size):
+        logging.debug(f'setting chunk_size to {chunk_size} (onboarding)')
+        self._chunk_size = max(1, int(chunk_size))
+        return self
+
+    # -----===== user commands =====-----
+
+    def bulk(self, devices):
+        """
+        onboard a list of devices
+
+        Each device spec is a dict of device properties (name, device_type,
+        device_role, platform, site, status ...) plus the optional keys
+        primary_interface (name or dict of interface properties),
+        primary_ipv4 (eg. 192.168.0.1/24) and make_primary (bool).
+
+        Args:
+            devices: list of device specs
+
+        Returns: dict with the added devices, the failed devices (and the reason)
+                 and the number of requests that were sent; a failed device
+                 without a name is keyed by its index in devices
+        """
+        logging.debug('-- entering onboarding.py/bulk')
+        self.open_nautobot()
+        self._requests = 0
+        failed = {}
+
+        # stage 1: devices
+        specs = {}
+        device_properties = []
+        for index, spec in enumerate(devices):
+            name = spec.get('name')
+            if name is None:
+                logging.error(f'device {index} has no name')
+                failed[index] = 'mandatory property missing'
+                continue
+            properties = self._get_device_properties(spec)
+            if properties is None:
+                failed[name] = 'mandatory property missing'
+                continue
+            specs[name] = spec
+            device_properties.append(properties)
+
+        nb_devices = {}
+        for properties, nb_device in zip(device_properties,
+                                         self._create(self._nautobot.dcim.devices, 'device', device_properties)):
+            name = properties['name']
+            if nb_device is None:
+                failed[name] = 'could not add device to SOT'
+                self._sot.log(device=name, log='could not add device to SOT')
+            else:
+                nb_devices[name] = nb_device
+                self._sot.log(device=name, log='device added to SOT')
+
+        # stage 2: primary interfaces
+        names = [n for n in nb_devices if specs[n].get('primary_interface')]
+        interface_properties = [self._get_interface_properties(specs[n], nb_devices[n].id) for n in names]
+        nb_interfaces = {}
+        for name, nb_interface in zip(names,
+                                      self._create(self._nautobot.dcim.interfaces, 'interface', interface_properties)):
+            if nb_interface is None:
+                failed[name] = 'could not create primary interface'
+                self._sot.log(device=name, log='could not create primary interface')
+            else:
+                nb_interfaces[name] = nb_interface
+
+        # stage 3: ip addresses; addresses that are already part of the sot
+        # are not added again but assigned to the interface in stage 4
+        names = [n for n in nb_interfaces if specs[n].get('primary_ipv4')]
+        addresses = [specs[n]['primary_ipv4'] for n in names]
+        existing = {}
+        if len(addresses) > 0:
+            for chunk in self._chunks(addresses):
+                self._requests += 1
+                try:
+                    for nb_addr in self._nautobot.ipam.ip_addresses.filter(address=chunk):
+                        existing[str(nb_addr.address)] = nb_addr
+                except Exception as exc:
+                    logging.error(f'could not get ip addresses; got exception {exc}')
+
+        new_names = [n for n in names if specs[n]['primary_ipv4'] not in existing]
+        new_addresses = [{'address': specs[n]['primary_ipv4'],
+                          'status': 'active',
+                          'assigned_object_type': 'dcim.interface',
+                          'assigned_object_id': nb_interfaces[n].id} for n in new_names]
+        nb_addresses = {}
+        for name, nb_addr in zip(new_names,
+                                 self._create(self._nautobot.ipam.ip_addresses, 'ip address', new_addresses)):
+            if nb_addr is None:
+                failed[name] = 'could not add ip address'
+                self._sot.log(device=name, log=f'could not add {specs[name]["primary_ipv4"]} to SOT')
+            else:
+                nb_addresses[name] = nb_addr.id
+
+        # stage 4: assign existing addresses to the primary interfaces
+        assign_names = [n for n in names if specs[n]['primary_ipv4'] in existing]
+        assignments = [{'id': existing[specs[n]['primary_ipv4']].id,
+                        'assigned_object_type': 'dcim.interface',
+                        'assigned_object_id': nb_interfaces[n].id} for n in assign_names]
+        for name, assignment, success in zip(assign_names,
+                                             assignments,
+                                             self._update(self._nautobot.ipam.ip_addresses, 'assignment', assignments)):
+            if success:
+                nb_addresses[name] = assignment['id']
+            else:
+                failed[name] = 'could not assign ip address'
+
+        # stage 5: primary ip
+        primary_names = [n for n in nb_addresses if specs[n].get('make_primary')]
+        primaries = [{'id': nb_devices[n].id, 'primary_ip4': nb_addresses[n]} for n in primary_names]
+        for name, success in zip(primary_names,
+                                 self._update(self._nautobot.dcim.devices, 'device', primaries)):
+            if success:
+                self._sot.log(device=name,
+                              log=f'added {specs[name]["primary_ipv4"]} to SOT and make {nb_interfaces[name]} primary')
+            else:
+                failed[name] = 'make interface primary failed'
+
+        logging.debug(f'onboarded {len(nb_devices)} device(s) using {self._requests} request(s); '
+                      f'{len(failed)} failed')
+        return {'devices': nb_devices,
+                'failed': failed,
+                'requests': self._requests}
@@ -0,0 +1,176 @@
+import logging
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+class QueryCache(object):
+    """
+    cache of the responses of named GraphQL queries
+
+    The cache key is the name of the query plus its variables. The cache
+    is invalidated incrementally: all object changes since the last sync
+    are read and only the queries that depend on a changed object type
+    are removed. Queries with unknown dependencies are removed on every change.
+    """
+
+    # object types each named query depends on
+    _dependencies = {'hldm': ['dcim.device', 'dcim.interface', 'ipam.ipaddress', 'ipam.vlan',
+                              'extras.tag', 'dcim.site', 'dcim.platform', 'dcim.devicerole',
+                              'dcim.cable', 'circuits.circuittermination', 'circuits.circuit'],
+                     'device_properties': ['dcim.device', 'ipam.ipaddress', 'dcim.site', 'extras.tag',
+                                           'dcim.devicerole', 'dcim.devicetype', 'dcim.platform'],
+                     'device_properties_and_interfaces': ['dcim.device', 'dcim.interface', 'ipam.ipaddress',
+                                                          'dcim.site', 'dcim.devicerole', 'dcim.devicetype',
+                                                          'dcim.platform'],
+                     'device_properties_by_cidr': ['dcim.device', 'ipam.ipaddress', 'dcim.site', 'extras.tag',
+                                                   'dcim.devicerole', 'dcim.devicetype', 'dcim.platform'],
+                     'device_interfaces': ['dcim.device', 'dcim.interface', 'ipam.ipaddress', 'extras.tag'],
+                     'all_vlans_and_sites': ['ipam.vlan', 'dcim.site'],
+                     'all_tags': ['extras.tag'],
+                     'id_cache': ['dcim.site', 'dcim.location', 'ipam.vlan', 'extras.tag', 'dcim.platform',
+                                  'dcim.devicetype', 'dcim.devicerole'],
+                     'prefixe': ['ipam.prefix', 'dcim.site', 'extras.tag']}
+    # queries that are never cached
+    _uncached = ['changes']
+    # changes are read a bit earlier than the last sync to tolerate clock skew
+    _skew = 60
+
+    def __init__(self, sot, filename=None, sync_interval=60, dependencies=None):
+        logging.debug(f'Creating QUERY CACHE object; filename={filename}')
+        self._sot = sot
+        self._lock = threading.RLock()
+        self._sync_interval = sync_interval
+        self._dependencies = dict(self._dependencies)
+        if dependencies:
+            self._dependencies.update(dependencies)
+        self._responses = {}
+        self._last_sync = None
+        self._last_check = 0
+        self._db = None
+        if filename:
+            self._open_db(os.path.expanduser(filename))
+
+    def _open_db(self, filename):
+        directory = os.path.dirname(filename)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(filename, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, name TEXT, response TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS query_cache_meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._db.commit()
+        except Exception as exc:
+            logging.error(f'could not open query cache {filename}; got exception {exc}')
+            self._db = None
+            return
+        for key, name, response in self._db.execute('SELECT key, name, response FROM query_cache'):
+            self._responses[key] = (name, json.loads(response))
+        row = self._db.execute("SELECT value FROM query_cache_meta WHERE key = 'last_sync'").fetchone()
+        if row:
+            self._last_sync = row[0]
+        logging.debug(f'loaded {len(self._responses)} responses from query cache; last sync {self._last_sync}')
+
+    def _get_key(self, name, variables):
+        return "%s:%s" % (name, json.dumps(variables or {}, sort_keys=True))
+
+    def _set_last_sync(self, last_sync):
+        self._last_sync = last_sync
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO query_cache_meta VALUES ('last_sync', ?)", (last_sync,))
+            self._db.commit()
+
+    def _remove(self, keys):
+        for key in keys:
+            self._responses.pop(key, None)
+        if self._db is not None and len(keys) > 0:
+            self._db.executemany('DELETE FROM query_cache WHERE key = ?', [(key,) for key in keys])
+            self._db.commit()
+
+    def _get_object_type(self, change):
+        object_type = change.get('changed_object_type')
+        if isinstance(object_type, dict):
+            return "%s.%s" % (object_type.get('app_label'), object_type.get('model'))
+        return object_type
+
+    # -----===== user commands =====-----
+
+    def is_cacheable(self, name):
+        return name is not None and name not in self._uncached
+
+    def get(self, name, variables):
+        with self._lock:
+            if time.time() - self._last_check > self._sync_interval:
+                self.sync()
+            entry = self._responses.get(self._get_key(name, variables))
+            if entry is not None:
+                logging.debug(f'using cached response of {name}')
+                # callers may modify the response; never hand out the cached one
+                return copy.deepcopy(entry[1])
+            return None
+
+    def set(self, name, variables, response):
+        with self._lock:
+            if 'errors' in response:
+                return
+            if self._last_sync is None:
+                self._set_last_sync(datetime.now(timezone.utc).isoformat())
+                self._last_check = time.time()
+            key = self._get_key(name, variables)
+            self._responses[key] = (name, copy.deepcopy(response))
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?)',
+                                 (key, name, json.dumps(response)))
+                self._db.commit()
+
+    def sync(self):
+        """
+        removes all responses that depend on objects changed since the last sync
+
+        Returns: set of changed object types
+        """
+        logging.debug(f'-- entering querycache.py/sync')
+        with self._lock:
+            self._last_check = time.time()
+            if self._last_sync is None:
+                return set()
+            start = (datetime.fromisoformat(self._last_sync) - timedelta(seconds=self._skew)).isoformat()
+            now = datetime.now(timezone.utc).isoformat()
+            try:
+                changes = self._sot.get.changes(start=start) or []
+            except Exception as exc:
+                logging.error(f'could not get changes; clearing query cache; got exception {exc}')
+                self.clear()
+                return None
+
+            changed_types = set(self._get_object_type(change) for change in changes)
+            if len(changed_types) > 0:
+                logging.debug(f'changed object types since {start}: {changed_types}')
+                invalid = []
+                for key, (name, response) in self._responses.items():
+                    dependencies = self._dependencies.get(name)
+                    if dependencies is None or None in changed_types \
+                            or len(changed_types.intersection(dependencies)) > 0:
+                        invalid.append(key)
+                logging.debug(f'removing {len(invalid)} response(s) from query cache')
+                self._remove(invalid)
+            self._set_last_sync(now)
+            return changed_types
+
+    def clear(self):
+        with self._lock:
+            self._remove(list(self._responses.keys()))
+            self._last_sync = None
+            if self._db is not None:
+                self._db.execute("DELETE FROM query_cache_meta WHERE key = 'last_sync'")
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,134 @@
+import logging
+
+
+class Resolver(object):
+    """
+    resolves names, slugs and addresses to IDs using the shared ID cache
+
+    Unknown values are looked up using the REST API and memoized. If many
+    entities are updated at once, preload() resolves all values of a batch
+    using one filter request per kind.
+    """
+
+    # kind: (app, endpoint, attribute used to look up the entity)
+    _endpoints = {'location': ('dcim', 'locations', 'slug'),
+                  'site': ('dcim', 'sites', 'name'),
+                  'ip_address': ('ipam', 'ip_addresses', 'address'),
+                  'platform': ('dcim', 'platforms', 'slug'),
+                  'device_type': ('dcim', 'device_types', 'slug'),
+                  'device_role': ('dcim', 'device_roles', 'slug'),
+                  'tag_name': ('extras', 'tags', 'name')}
+    # properties of an entity that are converted by Central.get_ids
+    _properties = {'primary_ip4': 'ip_address',
+                   'location': 'location'}
+
+    def __init__(self, sot):
+        logging.debug(f'Creating RESOLVER object')
+        self._sot = sot
+        self._nautobot = None
+        self._hits = 0
+        self._misses = 0
+
+    def open_nautobot(self):
+        if self._nautobot is None:
+            self._nautobot = self._sot.get_nautobot()
+
+    def _get_endpoint(self, kind):
+        app, endpoint, attribute = self._endpoints[kind]
+        return getattr(getattr(self._nautobot, app), endpoint), attribute
+
+    # -----===== user commands =====-----
+
+    def resolve(self, kind, value):
+        """
+        returns the ID of an entity or None if the entity is unknown
+
+        Args:
+            kind: kind of entity (location, ip_address ...)
+            value: slug, name or address of the entity
+
+        Returns: id
+        """
+        cache = self._sot.get_id_cache()
+        id = cache.get(kind, value)
+        if id is not None:
+            self._hits += 1
+            return id
+
+        self._misses += 1
+        self.open_nautobot()
+        endpoint, attribute = self._get_endpoint(kind)
+        try:
+            entity = endpoint.get(**{attribute: value})
+        except Exception as exc:
+            logging.error(f'could not resolve {kind} {value}; got exception {exc}')
+            return None
+        if entity is None:
+            logging.debug(f'unknown {kind} {value}')
+            return None
+        cache.set(kind, value, entity.id)
+        return entity.id
+
+    def preload(self, kind, values):
+        """
+        resolves all values of one kind that are not cached yet using one request
+
+        Args:
+            kind: kind of entity (location, ip_address ...)
+            values: list of slugs, names or addresses
+
+        Returns: dict of value: id
+        """
+        logging.debug(f'-- entering resolver.py/preload')
+        cache = self._sot.get_id_cache()
+        resolved = {}
+        missing = set()
+        for value in values:
+            if value is None:
+                continue
+            id = cache.get(kind, value)
+            if id is None:
+                missing.add(value)
+            else:
+                self._hits += 1
+                resolved[value] = id
+
+        self._misses += len(missing)
+        if len(missing) == 0:
+            return resolved
+
+        self.open_nautobot()
+        endpoint, attribute = self._get_endpoint(kind)
+        logging.debug(f'resolving {len(missing)} {kind}(s) using one request')
+        found = {}
+        try:
+            for entity in endpoint.filter(**{attribute: list(missing)}):
+                found[str(getattr(entity, attribute))] = entity.id
+        except Exception as exc:
+            logging.error(f'could not resolve {kind}s; got exception {exc}')
+            return resolved
+        cache.set_many(kind, found)
+        resolved.update(found)
+        return resolved
+
+    def prepare(self, list_of_properties):
+        """
+        preloads the IDs of all properties (see get_ids) of a batch of updates
+
+        Args:
+            list_of_properties: list of property dicts
+
+        Returns: None
+        """
+        for prop, kind in self._properties.items():
+            values = [p[prop] for p in list_of_properties
+                      if isinstance(p.get(prop), str)]
+            if len(values) > 0:
+                self.preload(kind, values)
+
+    def stats(self):
+        return {'hits': self._hits, 'misses': self._misses}
+
+    def reset_stats(self):
+        self._hits = 0
+        self._misses = 0
@@ -1,3 +1,4 @@
+import atexit
 import logging
 import os
 import json
@@ -14,6 +15,15 @@ from . import configparser
 from . import updater
 from . import rest
 from . import repository
+from . import client
+from . import cache
+from . import querycache
+from . import resolver
+from . import onboarding
+from . import aio
+from . import mirror
+from . import vlanindex
+from . import tags
 from ..utilities import misc
 from dotenv import load_dotenv, dotenv_values
 
@@ -35,6 +45,17 @@ class Sot:
         self.__analyzer = None
         self.__configparser = None
         self.__updater = None
+        self.__onboarding = None
+        self.__resolver = None
+        self.__aio = None
+        self.__mirror = None
+        self.__tags = None
+        self._use_mirror = False
+        # one pooled nautobot client per api_version shared by all modules
+        self.__nautobot = {}
+        self.__id_cache = None
+        self.__query_cache = None
+        self.__vlan_index = None
         self._sot_config = None
         self._logs = []
         self._per_device = {}
@@ -48,6 +69,7 @@ class Sot:
             logging.debug("reading config %s/%s" % (self.BASEDIR, filename))
             self._sot_config = misc.read_config("%s/%s" % (self.BASEDIR, filename))
             self._sot_config['nautobot'].update(named)
+            self._use_mirror = (self._sot_config['nautobot'].get('mirror') or {}).get('enabled', False)
 
     def __getattr__(self, item):
         if item == "ipam":
@@ -82,6 +104,30 @@ class Sot:
             if self.__updater is None:
                 self.__updater = updater.Updater(self)
             return self.__updater
+        if item == "onboarding":
+            if self.__onboarding is None:
+                self.__onboarding = onboarding.Onboarding(self)
+            return self.__onboarding
+        if item == "resolver":
+            if self.__resolver is None:
+                self.__resolver = resolver.Resolver(self)
+            return self.__resolver
+        if item == "aio":
+            if self.__aio is None:
+                self.__aio = aio.Aio(self)
+            return self.__aio
+        if item == "tags":
+            if self.__tags is None:
+                self.__tags = tags.Tags(self)
+            return self.__tags
+        if item == "mirror":
+            if self.__mirror is None:
+                config = (self._sot_config or {}).get('nautobot', {}).get('mirror') or {}
+                self.__mirror = mirror.Mirror(self,
+                                              filename=config.get('filename'),
+                                              poll_interval=config.get('poll_interval', 60))
+                atexit.register(self.__mirror.close)
+            return self.__mirror
 
     def get_token(self):
         return self._sot_config['nautobot']['token']
@@ -92,6 +138,47 @@ class Sot:
     def get_config(self):
         return self._sot_config
 
+    def get_nautobot(self, api_version=None):
+        if api_version not in self.__nautobot:
+            self.__nautobot[api_version] = client.open_nautobot(self.get_nautobot_url(),
+                                                                self.get_token(),
+                                                                (self._sot_config or {}).get('nautobot'),
+                                                                api_version=api_version)
+        return self.__nautobot[api_version]
+
+    def get_id_cache(self):
+        if self.__id_cache is None:
+            config = (self._sot_config or {}).get('nautobot', {}).get('cache') or {}
+            self.__id_cache = cache.IdCache(ttl=config.get('ttl'),
+                                            maxsize=config.get('maxsize', 10000),
+                                            filename=config.get('filename'))
+            atexit.register(self.__id_cache.close)
+        return self.__id_cache
+
+    def get_query_cache(self):
+        if self.__query_cache is None:
+            config = (self._sot_config or {}).get('nautobot', {}).get('query_cache') or {}
+            self.__query_cache = querycache.QueryCache(self,
+                                                       filename=config.get('filename'),
+                                                       sync_interval=config.get('sync_interval', 60),
+                                                       dependencies=config.get('dependencies'))
+            atexit.register(self.__query_cache.close)
+        return self.__query_cache
+
+    def get_vlan_index(self):
+        if self.__vlan_index is None:
+            ttl = ((self._sot_config or {}).get('nautobot', {}).get('cache') or {}).get('ttl')
+            self.__vlan_index = vlanindex.VlanIndex(self, ttl=ttl.get('vlan') if isinstance(ttl, dict) else ttl)
+        return self.__vlan_index
+
+    def use_mirror(self, use_mirror):
+        # read APIs (device, interface, vlan) are served by the local mirror
+        self._use_mirror = use_mirror
+        return self
+
+    def mirror_enabled(self):
+        return self._use_mirror and self.mirror.is_synced()
+
     def device(self, name):
         if name not in self.__devices:
             self.__devices[name] = device.Device(self, name)
@@ -0,0 +1,163 @@
+import logging
+from pynautobot.core.response import Record
+from pynautobot.models.dcim import Interfaces
+
+
+class Tags(object):
+    """
+    adds or removes tags of many devices and interfaces at once
+
+    All tags are resolved using the tag cache (one request for unknown
+    tags), the current tags of all objects are read using one request per
+    object type and the new tag sets are sent using one bulk PATCH per
+    object type.
+
+    usage:
+        sot.tags.apply(add=['ospf'], remove=['bgp'], to=['lab.local',
+                       {'device': 'lab.local', 'interface': 'GigabitEthernet0/1'},
+                       {'device': 'lab2.local', 'interfaces': ['Loopback0', 'Loopback1']}])
+    """
+
+    def __init__(self, sot):
+        logging.debug(f'Creating TAGS object')
+        self._sot = sot
+        self._nautobot = None
+
+    # -----===== internals =====-----
+
+    def open_nautobot(self):
+        if self._nautobot is None:
+            self._nautobot = self._sot.get_nautobot()
+
+    def _get_tag_ids(self, names):
+        """ returns dict of name: id of all known tags """
+        names = set(names)
+        ids = {name: str(id) for name, id in self._sot.resolver.preload('tag_name', names).items()}
+        for name in names.difference(ids.keys()):
+            logging.error(f'unknown tag {name}')
+        return ids
+
+    def _get_id(self, tag):
+        if isinstance(tag, Record):
+            return str(tag.id)
+        if isinstance(tag, dict):
+            return str(tag.get('id'))
+        return str(tag)
+
+    def _parse_selectors(self, selectors):
+        """
+        splits the selectors into records and names to look up
+
+        Returns: (records, device names, dict of device name: interface names or None for all)
+        """
+        records = {'devices': [], 'interfaces': []}
+        devices = set()
+        interfaces = {}
+        if isinstance(selectors, (str, dict, Record)):
+            selectors = [selectors]
+        for selector in selectors:
+            if isinstance(selector, Record):
+                # hasattr would get the full details of a device record
+                if isinstance(selector, Interfaces):
+                    records['interfaces'].append(selector)
+                else:
+                    records['devices'].append(selector)
+            elif isinstance(selector, str):
+                devices.add(selector)
+            elif isinstance(selector, dict) and 'device' in selector:
+                if selector['device'] in interfaces and interfaces[selector['device']] is None:
+                    # all interfaces of this device are already selected
+                    continue
+                if 'interface' in selector:
+                    interfaces.setdefault(selector['device'], set()).add(selector['interface'])
+                elif 'interfaces' in selector:
+                    names = selector['interfaces']
+                    if names == 'all':
+                        interfaces[selector['device']] = None
+                    else:
+                        interfaces.setdefault(selector['device'], set()).update(names)
+                else:
+                    devices.add(selector['device'])
+            else:
+                logging.error(f'cannot use {selector} as selector')
+        return records, devices, interfaces
+
+    def _get_records(self, selectors):
+        records, devices, interfaces = self._parse_selectors(selectors)
+        if len(devices) > 0:
+            found = list(self._nautobot.dcim.devices.filter(name=list(devices)))
+            for name in devices.difference([d.name for d in found]):
+                logging.error(f'unknown device {name}')
+            records['devices'].extend(found)
+        if len(interfaces) > 0:
+            found = {}
+            for interface in self._nautobot.dcim.interfaces.filter(device=list(interfaces.keys())):
+                names = interfaces.get(interface.device.name)
+                if names is None or interface.name in names:
+                    found[(interface.device.name, interface.name)] = interface
+            for device, names in interfaces.items():
+                for name in names or []:
+                    if (device, name) not in found:
+                        logging.error(f'unknown interface {name} on device {device}')
+            records['interfaces'].extend(found.values())
+        return records
+
+    def _patch(self, endpoint, title, updates):
+        updated = 0
+        chunk_size = self._sot.central.get_bulk_config().get('chunk_size')
+        for i in range(0, len(updates), chunk_size):
+            chunk = updates[i:i + chunk_size]
+            try:
+                endpoint.update(chunk)
+                logging.debug(f'updated tags of {len(chunk)} {title}')
+                updated += len(chunk)
+            except Exception as exc:
+                logging.error(f'could not update tags of {len(chunk)} {title}; got exception {exc}')
+        return updated
+
+    # -----===== user commands =====-----
+
+    def apply(self, add=None, remove=None, to=None, replace=False):
+        """
+        adds and removes tags of devices and interfaces
+
+        Args:
+            add: list of tag names to add
+            remove: list of tag names to remove
+            to: list of selectors; a selector is a device name, a device or
+                interface record, {'device': name}, {'device': name, 'interface': name}
+                or {'device': name, 'interfaces': [names] or 'all'}
+            replace: if True the tags of the objects are replaced by add
+
+        Returns: dict with the number of updated devices and interfaces, the
+                 number of unchanged objects and the list of unknown tags
+        """
+        logging.debug(f'-- entering tags.py/apply')
+        self.open_nautobot()
+        add = [add] if isinstance(add, str) else list(add or [])
+        remove = [remove] if isinstance(remove, str) else list(remove or [])
+
+        tag_ids = self._get_tag_ids(add + remove)
+        add_ids = set(tag_ids[name] for name in add if name in tag_ids)
+        remove_ids = set(tag_ids[name] for name in remove if name in tag_ids)
+        response = {'devices': 0,
+                    'interfaces': 0,
+                    'unchanged': 0,
+                    'unknown_tags': [name for name in set(add + remove) if name not in tag_ids]}
+
+        records = self._get_records(to or [])
+        for kind, objects in records.items():
+            updates = []
+            for obj in objects:
+                current = set(self._get_id(tag) for tag in obj.tags or [])
+                final = set(add_ids) if replace else current.union(add_ids)
+                final = final.difference(remove_ids)
+                if final == current:
+                    response['unchanged'] += 1
+                else:
+                    updates.append({'id': obj.id, 'tags': sorted(final)})
+            if len(updates) > 0:
+                response[kind] = self._patch(getattr(self._nautobot.dcim, kind), kind, updates)
+
+        logging.debug(f'applied tags; {response}')
+        return response
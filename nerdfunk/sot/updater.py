@@ -1,5 +1,4 @@
 import logging
-from pynautobot import api
 from . import central
 
 
@@ -8,7 +7,7 @@ class Updater(object):
     def __new__(cls, sot):
         cls._instance = None
         cls._sot = sot
-        cls._nautobot = api(cls._sot.get_nautobot_url(), token=cls._sot.get_token(), api_version=1.3)
+        cls._nautobot = cls._sot.get_nautobot(api_version=1.3)
         cls._endpoints = {'sites': cls._nautobot.dcim.sites,
                           'manufacturers': cls._nautobot.dcim.manufacturers,
                           'platforms': cls._nautobot.dcim.platforms,
@@ -60,7 +59,7 @@ class Updater(object):
 
     def open_nautobot(self):
         if self._nautobot is None:
-            self._nautobot = api(self._sot.get_nautobot_url(), token=self._sot.get_token())
+            self._nautobot = self._sot.get_nautobot(api_version=1.3)
 
     def update(self, *unnamed, **named):
         logging.debug("-- entering sot/updater.py/update")
@@ -0,0 +1,171 @@
+import logging
+import re
+import threading
+import time
+from pynautobot.core.response import Record
+
+
+class VlanIndex(object):
+    """
+    index of all VLANs keyed by (site, vid)
+
+    Global VLANs are keyed by (None, vid). The index is built using one
+    request that gets all VLANs and is kept coherent by add, update and
+    delete of Ipam. If a ttl is set the index is rebuilt when it is older.
+
+    usage:
+        index = sot.get_vlan_index()
+        vlan = index.get(100, site='mysite')
+    """
+
+    _REGEX_UUID = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+
+    def __init__(self, sot, ttl=None):
+        logging.debug(f'Creating VLAN INDEX object; ttl={ttl}')
+        self._sot = sot
+        self._nautobot = None
+        self._ttl = ttl
+        self._lock = threading.RLock()
+        self._vlans = None
+        self._keys = {}
+        self._loaded = 0
+        # (attribute, value): name of sites looked up by get_site_name
+        self._site_names = {}
+
+    def open_nautobot(self):
+        if self._nautobot is None:
+            self._nautobot = self._sot.get_nautobot()
+
+    def _get_key(self, vlan):
+        site = vlan.site if isinstance(vlan, Record) else vlan.get('site')
+        if isinstance(site, Record):
+            site = site.name
+        elif isinstance(site, dict):
+            site = site.get('name')
+        vid = vlan.vid if isinstance(vlan, Record) else vlan.get('vid')
+        return site, int(vid)
+
+    def _add(self, vlan, key=None):
+        key = key or self._get_key(vlan)
+        self._vlans[key] = vlan
+        self._keys[str(vlan.id)] = key
+        return key
+
+    def _is_stale(self):
+        if self._vlans is None:
+            return True
+        return self._ttl is not None and time.time() - self._loaded > self._ttl
+
+    # -----===== user commands =====-----
+
+    def load(self, force=False):
+        """ gets all VLANs using one (paginated) request """
+        with self._lock:
+            if not force and not self._is_stale():
+                return len(self._vlans)
+            logging.debug(f'-- entering vlanindex.py/load')
+            self.open_nautobot()
+            self._vlans = {}
+            self._keys = {}
+            ids = {}
+            for vlan in self._nautobot.ipam.vlans.all():
+                ids[self._add(vlan)] = vlan.id
+            self._sot.get_id_cache().set_many('vlan', ids)
+            self._loaded = time.time()
+            logging.debug(f'loaded {len(self._vlans)} VLAN(s) to the index')
+            return len(self._vlans)
+
+    def get(self, vid, site=None):
+        """
+        returns the VLAN record or None
+
+        Args:
+            vid: VLAN ID
+            site: site (see get_site_name) or None to get the global VLAN
+
+        Returns: VLAN record
+        """
+        site = self.get_site_name(site)
+        with self._lock:
+            self.load()
+            return self._vlans.get((site, int(vid)))
+
+    def vlans(self, site=None):
+        """ returns a dict of vid: VLAN record of a site or of all global VLANs """
+        site = self.get_site_name(site)
+        with self._lock:
+            self.load()
+            return {vid: vlan for (vlan_site, vid), vlan in self._vlans.items() if vlan_site == site}
+
+    def get_site_name(self, site):
+        """
+        returns the name of a site; the index is keyed by site name
+
+        Args:
+            site: name, UUID, record or dict containing the name, slug or id
+
+        Returns: name of the site or None
+        """
+        if site is None or isinstance(site, str) and not re.match(self._REGEX_UUID, site):
+            return site
+        if isinstance(site, Record):
+            return site.name
+        if isinstance(site, dict):
+            if 'name' in site:
+                return site['name']
+            attribute = 'slug' if 'slug' in site else 'id'
+            value = site.get(attribute)
+        else:
+            attribute = 'id'
+            value = site
+        value = str(value)
+        with self._lock:
+            if (attribute, value) in self._site_names:
+                return self._site_names[(attribute, value)]
+        self.open_nautobot()
+        try:
+            entity = self._nautobot.dcim.sites.get(**{attribute: value})
+        except Exception as exc:
+            logging.error(f'could not get site {value}; got exception {exc}')
+            return None
+        if entity is None:
+            logging.error(f'unknown site {value}')
+            return None
+        with self._lock:
+            self._site_names[(attribute, value)] = entity.name
+        return entity.name
+
+    def add(self, vlan, key=None):
+        """ adds a (new) VLAN to the index; key is (site, vid) if known """
+        with self._lock:
+            if self._vlans is None:
+                return
+            key = self._add(vlan, key)
+            self._sot.get_id_cache().set('vlan', key, vlan.id)
+
+    def update(self, vlan, key=None):
+        """ replaces the VLAN in the index; the key may have changed """
+        with self._lock:
+            self.remove(vlan)
+            self.add(vlan, key)
+
+    def remove(self, vlan):
+        """ removes a VLAN (record or ID) from the index """
+        with self._lock:
+            if self._vlans is None:
+                return
+            id = str(vlan.id) if isinstance(vlan, Record) else str(vlan)
+            key = self._keys.pop(id, None)
+            if key is not None:
+                self._vlans.pop(key, None)
+                self._sot.get_id_cache().delete('vlan', key)
+
+    def clear(self):
+        with self._lock:
+            self._vlans = None
+            self._keys = {}
+            self._loaded = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._vlans) if self._vlans is not None else 0
@@ -0,0 +1,54 @@
+import base64
+import logging
+from functools import lru_cache
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+
+# max. number of derived keys kept in memory
+MAX_KEYS = 32
+
+
+def derive_key(encryption_key, salt, iterations):
+    """
+    derives the key using PBKDF2-HMAC-SHA256
+
+    Args:
+        encryption_key: encryption key (bytes)
+        salt: salt (bytes)
+        iterations: number of iterations
+
+    Returns: urlsafe base64 encoded key (bytes) that can be used by Fernet
+    """
+    logging.debug(f'deriving key using {iterations} iterations')
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(encryption_key))
+
+
+@lru_cache(maxsize=MAX_KEYS)
+def get_fernet(encryption_key, salt, iterations):
+    """
+    derives the key using PBKDF2-HMAC-SHA256 and returns a Fernet object
+
+    The derived key is memoized per (encryption key, salt, iterations) so
+    that the expensive KDF runs only once per key. Use clear_key_cache()
+    to remove all derived keys from memory.
+
+    Args:
+        encryption_key: encryption key (bytes)
+        salt: salt (bytes)
+        iterations: number of iterations
+
+    Returns: Fernet
+    """
+    return Fernet(derive_key(encryption_key, salt, iterations))
+
+
+def clear_key_cache():
+    get_fernet.cache_clear()